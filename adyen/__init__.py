@@ -232,6 +232,7 @@ class HostedPaymentResult(object):
         self.payment_method = params.get('paymentMethod')
         self.shopper_locale = params['shopperLocale']
         self.merchant_return_data = params.get('merchantReturnData')
+        self.merchant_sig = params['merchantSig']
 
     @classmethod
     def mock(cls, backend, url):
@@ -345,3 +346,26 @@ def is_old_browser(user_agent):
         return False
 
     return "MSIE 8" in user_agent or "MSIE 9" in user_agent
+
+
+def check_basic_auth(authorization, credentials):
+    """
+    Return whether the value of an HTTP Authorization header carries the
+    given (user, password) credentials using basic authentication.
+    """
+    if not authorization:
+        return False
+
+    auth = authorization.split()
+    if len(auth) != 2:
+        return False
+
+    if auth[0].lower() != "basic":
+        return False
+
+    try:
+        user, password = base64.b64decode(auth[1]).split(':', 1)
+    except (TypeError, ValueError):
+        return False
+
+    return (user, password) == tuple(credentials)
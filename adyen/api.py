@@ -38,6 +38,7 @@ from urlparse import urlparse, parse_qs
 
 from adyen import (HostedPayment, HostedPaymentResult, _get_result_signature,
                    HostedPaymentNotification)
+from adyen.client import Modification
 
 
 def create_payment(backend, merchant_reference, amount, currency):
@@ -87,3 +88,13 @@ def get_payment_result(backend, payment_result_params):
 
 def get_payment_notification(payment_notification_params):
     return HostedPaymentNotification(payment_notification_params)
+
+
+def create_modification(action, original_reference, amount=None,
+                        currency=None, reference=None, idempotency_key=None):
+    return Modification(action, original_reference, amount, currency,
+                        reference, idempotency_key)
+
+
+def submit_modifications(client, modifications, concurrency=None):
+    return client.submit_all(modifications, concurrency=concurrency)
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+
+"""
+A client for the Adyen payment webservice (PAL), used to send modifications
+(capture, refund, cancel, cancelOrRefund) of existing payments and recurring
+authorisations.
+
+The client keeps a pool of persistent connections and can submit many
+requests concurrently, optionally limited to a number of requests per second.
+Requests that fail before they were sent, or that Adyen rejects as too many,
+are retried. Requests that fail after they were sent, with a connection error
+or a server error, might have been processed and are only retried if they
+carry an idempotency key, which Adyen uses to process them at most once.
+"""
+
+from __future__ import unicode_literals
+
+import base64
+from contextlib import contextmanager
+import httplib
+import json
+import logging
+import Queue
+import socket
+import threading
+import time
+from urlparse import urlparse
+
+log = logging.getLogger(__name__)
+
+PAL_URL = 'https://pal-{live_or_test}.adyen.com/pal/servlet/Payment/v12/'
+
+
+class ClientError(Exception):
+    pass
+
+
+class UncertainOutcomeError(ClientError):
+    """
+    The request failed after it was sent, so Adyen may have processed it.
+    """
+    pass
+
+
+def _get_idempotency_key(reference, action):
+    if reference is None:
+        return None
+    return '{}-{}'.format(reference, action)
+
+
+class ConnectionPool(object):
+    """
+    A fixed number of persistent HTTP(S) connections to a single host.
+    Connections are created lazily and replaced after errors.
+    """
+    def __init__(self, url, size=4, timeout=30):
+        url = urlparse(url)
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.size = size
+        self.timeout = timeout
+        self._connections = Queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            self._connections.put(None)
+
+    def _new_connection(self):
+        if self.scheme == 'https':
+            connection_class = httplib.HTTPSConnection
+        else:
+            connection_class = httplib.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection, waiting until one is free. The connection is
+        discarded if an exception is raised while it is borrowed.
+        """
+        connection = self._connections.get()
+        if connection is None:
+            connection = self._new_connection()
+        try:
+            yield connection
+        except Exception:
+            connection.close()
+            connection = None
+            raise
+        finally:
+            self._connections.put(connection)
+
+    def close(self):
+        for _ in range(self.size):
+            connection = self._connections.get()
+            if connection is not None:
+                connection.close()
+        for _ in range(self.size):
+            self._connections.put(None)
+
+
+class RateLimiter(object):
+    """
+    Allow at most rate calls of wait() per second to return, spaced evenly,
+    across all threads.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            delay = self._next - now
+            self._next = max(self._next, now) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Modification(object):
+    """
+    A modification of an existing payment, identified by original_reference,
+    the pspReference of the payment.
+
+    After submission, psp_reference and response hold Adyen's answer, or error
+    holds a description of what went wrong. uncertain is then True if Adyen
+    may have processed the modification anyway.
+
+    idempotency_key defaults to the reference and the action, so the reference
+    should be unique among modifications of the same kind.
+    """
+    CAPTURE = 'capture'
+    REFUND = 'refund'
+    CANCEL = 'cancel'
+    CANCEL_OR_REFUND = 'cancelOrRefund'
+
+    def __init__(self, action, original_reference, amount=None, currency=None,
+                 reference=None, idempotency_key=None):
+        self.action = action
+        self.original_reference = original_reference
+        self.amount = amount
+        self.currency = currency
+        self.reference = reference
+        self.idempotency_key = (idempotency_key
+                                or _get_idempotency_key(reference, action))
+        self.psp_reference = None
+        self.response = None
+        self.error = None
+        self.uncertain = False
+
+    def get_data(self, merchant_account):
+        data = {
+            'merchantAccount': merchant_account,
+            'originalReference': self.original_reference,
+        }
+        if self.reference is not None:
+            data['reference'] = self.reference
+        if self.amount is not None:
+            data['modificationAmount'] = {'value': self.amount,
+                                          'currency': self.currency}
+        return data
+
+    def handle_response(self, data):
+        self.psp_reference = data.get('pspReference')
+        self.response = data.get('response')
+
+    @property
+    def accepted(self):
+        return self.response == '[{}-received]'.format(self.action)
+
+
+class RecurringAuthorisation(object):
+    """
+    An authorisation of a payment with stored payment details of the shopper,
+    selected by recurring_detail_reference, without shopper interaction.
+
+    After submission, psp_reference, result_code and refusal_reason hold
+    Adyen's answer, or error holds a description of what went wrong. uncertain
+    is then True if Adyen may have processed the authorisation anyway.
+
+    idempotency_key defaults to the reference and the action, so the reference
+    should be unique among authorisations.
+    """
+    action = 'authorise'
+
+    AUTHORISED = 'Authorised'
+    REFUSED = 'Refused'
+    RECEIVED = 'Received'
+    ERROR = 'Error'
+
+    def __init__(self, shopper_reference, amount, currency, reference,
+                 recurring_detail_reference='LATEST', contract='RECURRING',
+                 shopper_email=None, idempotency_key=None):
+        self.shopper_reference = shopper_reference
+        self.amount = amount
+        self.currency = currency
+        self.reference = reference
+        self.recurring_detail_reference = recurring_detail_reference
+        self.contract = contract
+        self.shopper_email = shopper_email
+        self.idempotency_key = (
+            idempotency_key or _get_idempotency_key(reference, self.action))
+        self.psp_reference = None
+        self.result_code = None
+        self.refusal_reason = None
+        self.error = None
+        self.uncertain = False
+
+    def get_data(self, merchant_account):
+        data = {
+            'merchantAccount': merchant_account,
+            'amount': {'value': self.amount, 'currency': self.currency},
+            'reference': self.reference,
+            'shopperReference': self.shopper_reference,
+            'selectedRecurringDetailReference':
+            self.recurring_detail_reference,
+            'recurring': {'contract': self.contract},
+            'shopperInteraction': 'ContAuth',
+        }
+        if self.shopper_email is not None:
+            data['shopperEmail'] = self.shopper_email
+        return data
+
+    def handle_response(self, data):
+        self.psp_reference = data.get('pspReference')
+        self.result_code = data.get('resultCode')
+        self.refusal_reason = data.get('refusalReason')
+
+    @property
+    def authorised(self):
+        return self.result_code == self.AUTHORISED
+
+
+class PaymentClient(object):
+    def __init__(self, merchant_account, username, password, is_live=False,
+                 url=None, pool_size=4, rate=None, retries=3,
+                 retry_delay=0.5, timeout=30):
+        """
+        url defaults to Adyen's test or live system, depending on is_live.
+        Point it to a local server for tests.
+
+        rate is the maximum number of requests per second, None for no limit.
+        """
+        if url is None:
+            url = PAL_URL.format(live_or_test=is_live and 'live' or 'test')
+        self.merchant_account = merchant_account
+        self.is_live = is_live
+        self.path = urlparse(url).path
+        self.pool = ConnectionPool(url, size=pool_size, timeout=timeout)
+        self.rate_limiter = rate and RateLimiter(rate) or None
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.headers = {
+            'Authorization': 'Basic {}'.format(base64.b64encode(
+                '{}:{}'.format(username, password).encode('utf-8'))),
+            'Content-Type': 'application/json',
+        }
+
+    def post(self, action, data, idempotency_key=None):
+        """
+        Post data to the given webservice action and return the decoded
+        response. Raise ClientError if that fails even after retrying, and
+        UncertainOutcomeError if Adyen may have processed the request.
+
+        Without an idempotency_key, requests are not retried after they were
+        sent.
+        """
+        body = json.dumps(data)
+        path = self.path + action
+        headers = self.headers
+        if idempotency_key is not None:
+            headers = dict(headers, **{'Idempotency-Key': idempotency_key})
+
+        uncertain = False
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            if self.rate_limiter:
+                self.rate_limiter.wait()
+
+            sent = False
+            try:
+                with self.pool.connection() as connection:
+                    connection.request('POST', path, body, headers)
+                    sent = True
+                    response = connection.getresponse()
+                    status = response.status
+                    content = response.read()
+            except (httplib.HTTPException, socket.error) as e:
+                error = "Connection error: {}".format(e)
+                uncertain = uncertain or sent
+            else:
+                if status < 300:
+                    try:
+                        return json.loads(content)
+                    except ValueError:
+                        raise UncertainOutcomeError(
+                            "Invalid response: {}".format(content))
+
+                error = "HTTP {}: {}".format(status, content)
+                if status < 500 and status != 429:
+                    break
+                # Adyen doesn't process requests it rejects as too many
+                uncertain = uncertain or status != 429
+
+            if uncertain and idempotency_key is None:
+                break
+            log.warning("%s: %s, attempt %d", action, error, attempt + 1)
+
+        if uncertain:
+            raise UncertainOutcomeError(error)
+        raise ClientError(error)
+
+    def submit(self, request):
+        """
+        Submit a single request, a Modification for example, and record the
+        outcome on it.
+        """
+        try:
+            data = self.post(request.action,
+                             request.get_data(self.merchant_account),
+                             request.idempotency_key)
+        except ClientError as e:
+            request.error = '{}'.format(e)
+            request.uncertain = isinstance(e, UncertainOutcomeError)
+        else:
+            request.handle_response(data)
+        return request
+
+    def submit_all(self, requests, concurrency=None):
+        """
+        Submit all requests using up to concurrency threads, which defaults to
+        the connection pool size, and return them.
+        """
+        requests = list(requests)
+        pending = Queue.Queue()
+        for request in requests:
+            pending.put(request)
+
+        def work():
+            while True:
+                try:
+                    request = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    self.submit(request)
+                except Exception as e:
+                    log.exception("Submitting %s failed", request.action)
+                    request.error = '{}'.format(e)
+
+        threads = [threading.Thread(target=work) for _ in
+                   range(min(concurrency or self.pool.size, len(requests)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return requests
+
+    def capture(self, original_reference, amount, currency, reference=None):
+        return self.submit(Modification(Modification.CAPTURE,
+                                        original_reference, amount, currency,
+                                        reference))
+
+    def refund(self, original_reference, amount, currency, reference=None):
+        return self.submit(Modification(Modification.REFUND,
+                                        original_reference, amount, currency,
+                                        reference))
+
+    def cancel(self, original_reference, reference=None):
+        return self.submit(Modification(Modification.CANCEL,
+                                        original_reference,
+                                        reference=reference))
+
+    def cancel_or_refund(self, original_reference, reference=None):
+        return self.submit(Modification(Modification.CANCEL_OR_REFUND,
+                                        original_reference,
+                                        reference=reference))
+
+    def authorise_recurring(self, shopper_reference, amount, currency,
+                            reference, **kwargs):
+        return self.submit(RecurringAuthorisation(
+            shopper_reference, amount, currency, reference, **kwargs))
+
+    def close(self):
+        self.pool.close()
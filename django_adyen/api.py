@@ -2,13 +2,24 @@
 
 from __future__ import unicode_literals
 
+from datetime import datetime, timedelta
+import hashlib
+import threading
+
 from django.conf import settings
+from django.core.cache import caches
 from django.core.urlresolvers import reverse
+import pytz
 
+from adyen import is_naive
 import adyen.api as adyen_api
+from adyen.client import Modification as AdyenModification, PaymentClient
 
 from .backends import get_backend
-from .models import Payment, Result, Notification
+from .instrumentation import instrumented
+from .models import Payment, Result, Notification, Modification
+from .processing import NotificationProcessor
+from .routers import uses_write_database
 
 
 def create_payment(order_number, *args, **kwargs):
@@ -29,6 +40,7 @@ def create_payment(order_number, *args, **kwargs):
     return payment
 
 
+@instrumented('pay')
 def pay(payment, build_absolute_uri=None, force_multi=False):
     if not payment.res_url:
         if not build_absolute_uri:
@@ -38,9 +50,85 @@ def pay(payment, build_absolute_uri=None, force_multi=False):
         payment.res_url = build_absolute_uri(
             reverse('django-adyen:payment-result'))
 
-    Payment.objects.persist(payment)
+    cache = _get_redirect_cache()
+    if cache is None:
+        Payment.objects.persist(payment)
+        return adyen_api.pay(payment, force_multi=force_multi)
 
-    return adyen_api.pay(payment, force_multi=force_multi)
+    key = _get_redirect_cache_key(payment, force_multi)
+    cached = cache.get(key)
+    if cached is not None:
+        payment.merchant_reference, url = cached
+        return url
+
+    # fix the session validity so that the persisted payment, the url and
+    # the cache entry all expire at the same time
+    session_validity = _get_session_validity(payment)
+    payment.session_validity = session_validity
+
+    Payment.objects.persist(payment)
+    url = adyen_api.pay(payment, force_multi=force_multi)
+
+    timeout = int((session_validity - datetime.now(pytz.utc)).total_seconds()
+                  - getattr(settings, 'ADYEN_REDIRECT_CACHE_MARGIN', 3600))
+    if timeout > 0:
+        cache.set(key, (payment.merchant_reference, url), timeout)
+
+    return url
+
+
+def _get_redirect_cache():
+    alias = getattr(settings, 'ADYEN_REDIRECT_CACHE', None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def _get_redirect_cache_key(payment, force_multi):
+    """
+    Return a cache key derived from everything that goes into the redirect
+    url of the payment.
+    """
+    fields = [
+        ('merchant_account', payment.merchant_account),
+        ('skin_code', payment.skin_code),
+        ('is_live', payment.is_live),
+        ('payment_flow', payment.backend.payment_flow),
+        ('force_multi', force_multi),
+        ('merchant_reference', payment.merchant_reference),
+        ('payment_amount', payment.payment_amount),
+        ('currency_code', payment.currency_code),
+        ('ship_before_date', payment._ship_before_date),
+        ('session_validity', payment._session_validity),
+        ('shopper_locale', payment.shopper_locale),
+        ('order_data', payment.order_data),
+        ('merchant_return_data', payment.merchant_return_data),
+        ('country_code', payment.country_code),
+        ('shopper_email', payment.shopper_email),
+        ('shopper_reference', payment.shopper_reference),
+        ('recurring_contract', payment.recurring_contract),
+        ('allowed_methods', payment.allowed_methods),
+        ('blocked_methods', payment.blocked_methods),
+        ('offset', payment.offset),
+        ('brand_code', payment.brand_code),
+        ('issuer_id', payment.issuer_id),
+        ('shopper_statement', payment.shopper_statement),
+        ('offer_email', payment.offer_email),
+        ('res_url', payment.res_url),
+    ]
+    content = "\n".join("{}={!r}".format(name, value)
+                        for name, value in fields)
+    return ('django_adyen:redirect:{}'
+            .format(hashlib.sha256(content.encode('utf-8')).hexdigest()))
+
+
+def _get_session_validity(payment):
+    value = payment._session_validity
+    if isinstance(value, timedelta):
+        return datetime.now(pytz.utc) + value
+    if is_naive(value):
+        return value.replace(tzinfo=pytz.utc)
+    return value
 
 
 def mock_payment_result_params(*args, **kwargs):
@@ -51,6 +139,8 @@ def mock_payment_result_url(*args, **kwargs):
     return adyen_api.mock_payment_result_url(get_backend(), *args, **kwargs)
 
 
+@instrumented('get_payment_result')
+@uses_write_database
 def get_payment_result(*args, **kwargs):
     payment_result = adyen_api.get_payment_result(get_backend(),
                                                   *args, **kwargs)
@@ -58,6 +148,8 @@ def get_payment_result(*args, **kwargs):
     return payment_result
 
 
+@instrumented('get_payment_notification')
+@uses_write_database
 def get_payment_notification(*args, **kwargs):
     notification = adyen_api.get_payment_notification(*args, **kwargs)
     return Notification.objects.persist(notification)
@@ -65,3 +157,86 @@ def get_payment_notification(*args, **kwargs):
 
 def get_unhandled_notifications():
     return Notification.objects.originals().filter(handled=False)
+
+
+@instrumented('process_unhandled_notifications')
+@uses_write_database
+def process_unhandled_notifications(processor=None, limit=None):
+    """
+    Process unhandled notifications with the handlers registered in
+    django_adyen.processing.handlers, the oldest of each lane first, fetching
+    at most limit notifications. Return how many were handled.
+    """
+    return (processor or NotificationProcessor()).process_unhandled(limit)
+
+
+_payment_client = None
+_payment_client_lock = threading.Lock()
+
+
+def get_payment_client():
+    """
+    Return the webservice client. It is shared within the process, so that
+    its connections are reused.
+    """
+    global _payment_client
+
+    with _payment_client_lock:
+        if _payment_client is None:
+            backend = get_backend()
+            username, password = backend.get_webservice_credentials()
+            _payment_client = PaymentClient(
+                backend.merchant_account, username, password,
+                is_live=backend.is_live,
+                url=getattr(settings, 'ADYEN_WEBSERVICE_URL', None),
+                pool_size=getattr(settings, 'ADYEN_WEBSERVICE_POOL_SIZE', 4),
+                rate=getattr(settings, 'ADYEN_WEBSERVICE_RATE', None))
+        return _payment_client
+
+
+@instrumented('submit_modifications')
+def submit_modifications(modifications, concurrency=None):
+    """
+    Submit adyen.client.Modification objects concurrently and store their
+    outcome as django_adyen.models.Modification records, which are returned.
+    """
+    client = get_payment_client()
+    modifications = adyen_api.submit_modifications(client, modifications,
+                                                   concurrency=concurrency)
+    return Modification.objects.persist_all(modifications, client.is_live)
+
+
+def _modify_authorisations(action, notifications, with_amount,
+                           concurrency=None):
+    return submit_modifications(
+        [adyen_api.create_modification(
+            action, notification.psp_reference,
+            amount=with_amount and notification.value or None,
+            currency=with_amount and notification.currency or None,
+            reference=notification.merchant_reference)
+         for notification in notifications],
+        concurrency=concurrency)
+
+
+def capture(notifications, concurrency=None):
+    """
+    Capture the full amount of the payments authorised by the given
+    AUTHORISATION notifications.
+    """
+    return _modify_authorisations(AdyenModification.CAPTURE, notifications,
+                                  True, concurrency)
+
+
+def refund(notifications, concurrency=None):
+    return _modify_authorisations(AdyenModification.REFUND, notifications,
+                                  True, concurrency)
+
+
+def cancel(notifications, concurrency=None):
+    return _modify_authorisations(AdyenModification.CANCEL, notifications,
+                                  False, concurrency)
+
+
+def cancel_or_refund(notifications, concurrency=None):
+    return _modify_authorisations(AdyenModification.CANCEL_OR_REFUND,
+                                  notifications, False, concurrency)
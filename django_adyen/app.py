@@ -10,7 +10,9 @@ urlpatterns = [
     url(r'^payment-done/$', views.PaymentResultView.as_view(),
         name='payment-result'),
     url(r'^notify/$', views.NotificationView.as_view(),
-        name='payment-notification')
+        name='payment-notification'),
+    url(r'^notify/spool/$', views.SpoolNotificationView.as_view(),
+        name='payment-notification-spool')
 ]
 
 urls = urlpatterns, 'django-adyen', 'django-adyen'
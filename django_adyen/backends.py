@@ -29,3 +29,7 @@ class SimpleSettingsBackend(Backend):
     def get_notification_credentials(self):
         return (settings.ADYEN_NOTIFICATION_USER,
                 settings.ADYEN_NOTIFICATION_PASSWORD)
+
+    def get_webservice_credentials(self):
+        return (settings.ADYEN_WEBSERVICE_USER,
+                settings.ADYEN_WEBSERVICE_PASSWORD)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import threading
+
+from django.db import connections, transaction
+
+
+class RecentCache(object):
+    """
+    A thread-safe, in-process mapping that keeps only the most recently used
+    entries. Once more than max_size entries are stored, the least recently
+    used one is dropped.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                return default
+            self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def set_on_commit(self, key, value, using):
+        """
+        Like set(), but only once the current transaction on the given
+        database is committed, so that the cache never refers to records that
+        were rolled back. Without transaction.on_commit() (Django < 1.9)
+        nothing is cached inside a transaction.
+        """
+        if not connections[using].in_atomic_block:
+            self.set(key, value)
+        elif hasattr(transaction, 'on_commit'):
+            transaction.on_commit(lambda: self.set(key, value), using=using)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
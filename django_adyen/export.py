@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""
+Export payments, results and notifications as CSV, JSON lines or Parquet.
+
+Records are read in chunks ordered by primary key and streamed to the output
+file, so memory use doesn't depend on the number of records. The JSON text of
+Notification.additional_params is written as it is stored, without decoding
+it.
+
+Parquet export requires pyarrow.
+"""
+
+from __future__ import unicode_literals
+
+import csv
+from datetime import date, datetime
+from itertools import islice
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from .fields import RawJSON
+from .models import Notification, Payment, Result
+
+MODELS = {
+    'payments': Payment,
+    'results': Result,
+    'notifications': Notification,
+}
+
+CSV = 'csv'
+JSONL = 'jsonl'
+PARQUET = 'parquet'
+
+
+def get_chunk_size():
+    return getattr(settings, 'ADYEN_EXPORT_CHUNK_SIZE', 2000)
+
+
+def export(kind, fileobj, format=CSV, start=None, end=None, event_codes=None,
+           chunk_size=None):
+    """
+    Write the records of the given kind (payments, results or notifications)
+    created in [start, end) to the binary file object fileobj. event_codes
+    restricts notifications to these event codes. Return the number of
+    exported records.
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    model = MODELS[kind]
+    fields = model._meta.concrete_fields
+    rows = iter_rows(model, fields, start, end, event_codes, chunk_size)
+
+    writer = {
+        CSV: write_csv,
+        JSONL: write_jsonl,
+        PARQUET: write_parquet,
+    }[format]
+    return writer(fileobj, fields, rows, chunk_size)
+
+
+def iter_rows(model, fields, start=None, end=None, event_codes=None,
+              chunk_size=None):
+    """
+    Yield the values of the given fields of the records of the model as
+    tuples, reading chunk_size records at a time.
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    queryset = model.objects.order_by('pk')
+    if start is not None:
+        queryset = queryset.filter(created_datetime__gte=start)
+    if end is not None:
+        queryset = queryset.filter(created_datetime__lt=end)
+    if event_codes:
+        queryset = queryset.filter(event_code__in=event_codes)
+
+    names = [field.attname for field in fields]
+    pk_index = names.index(model._meta.pk.attname)
+    last_pk = None
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+
+        count = 0
+        for row in chunk.values_list(*names)[:chunk_size].iterator():
+            count += 1
+            last_pk = row[pk_index]
+            yield row
+
+        if count < chunk_size:
+            return
+
+
+def write_csv(fileobj, fields, rows, chunk_size=None):
+    writer = csv.writer(fileobj)
+    writer.writerow([field.attname.encode('utf-8') for field in fields])
+    count = 0
+    for row in rows:
+        writer.writerow([_to_csv(value) for value in row])
+        count += 1
+    return count
+
+
+def _to_csv(value):
+    if value is None:
+        return b''
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def write_jsonl(fileobj, fields, rows, chunk_size=None):
+    keys = [json.dumps(field.attname) for field in fields]
+    count = 0
+    for row in rows:
+        fileobj.write(('{' + ', '.join(
+            '{}: {}'.format(key, _to_json(value))
+            for key, value in zip(keys, row)) + '}\n').encode('utf-8'))
+        count += 1
+    return count
+
+
+def _to_json(value):
+    if isinstance(value, RawJSON):
+        return value
+    if isinstance(value, (date, datetime)):
+        # like CSV, DjangoJSONEncoder would cut datetimes to milliseconds
+        value = value.isoformat()
+    return json.dumps(value, cls=DjangoJSONEncoder)
+
+
+def write_parquet(fileobj, fields, rows, chunk_size=None):
+    if pyarrow is None:
+        raise ImportError("Parquet export requires pyarrow.")
+
+    chunk_size = chunk_size or get_chunk_size()
+    schema = pyarrow.schema([
+        pyarrow.field(field.attname, _get_parquet_type(field))
+        for field in fields])
+    writer = None
+    count = 0
+    try:
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+
+            table = pyarrow.Table.from_arrays(
+                [pyarrow.array([_to_parquet(value) for value in column],
+                               type=_get_parquet_type(field))
+                 for field, column in zip(fields, zip(*chunk))],
+                schema=schema)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(fileobj, schema)
+            writer.write_table(table)
+            count += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def _get_parquet_type(field):
+    return {
+        'AutoField': pyarrow.int64(),
+        'ForeignKey': pyarrow.int64(),
+        'IntegerField': pyarrow.int64(),
+        'BooleanField': pyarrow.bool_(),
+        'NullBooleanField': pyarrow.bool_(),
+        'DateField': pyarrow.date32(),
+        'DateTimeField': pyarrow.timestamp('us'),
+    }.get(field.get_internal_type(), pyarrow.string())
+
+
+def _to_parquet(value):
+    if isinstance(value, RawJSON):
+        return unicode(value)
+    return value
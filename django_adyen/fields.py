@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+
+from django.db import models
+
+
+class RawJSON(unicode):
+    """
+    JSON text as loaded from the database, not decoded yet.
+    """
+
+
+class _LazyJSONDescriptor(object):
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+
+        try:
+            value = instance.__dict__[self.field.attname]
+        except KeyError:
+            # deferred with defer() or only()
+            instance.refresh_from_db(fields=[self.field.attname])
+            value = instance.__dict__[self.field.attname]
+        if isinstance(value, RawJSON):
+            value = json.loads(value)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class JSONField(models.TextField):
+    """
+    Store any JSON serializable value as JSON text. Values loaded from the
+    database are only decoded on first attribute access, so loading records
+    whose value is never looked at costs nothing. values() and values_list()
+    return the undecoded RawJSON text.
+    """
+    def contribute_to_class(self, cls, name, *args, **kwargs):
+        super(JSONField, self).contribute_to_class(cls, name, *args, **kwargs)
+        setattr(cls, self.name, _LazyJSONDescriptor(self))
+
+    def from_db_value(self, value, expression, connection, context):
+        if value is None:
+            return value
+        return RawJSON(value)
+
+    def to_python(self, value):
+        if isinstance(value, basestring):
+            return json.loads(value)
+        return value
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, RawJSON):
+            return value
+        return json.dumps(value)
+
+    def value_to_string(self, obj):
+        return self.get_prep_value(self.value_from_object(obj))
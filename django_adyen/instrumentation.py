@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+Count and time the SQL queries of django_adyen code paths and check them
+against a budget, to notice when a change adds queries.
+
+In tests:
+
+    class PaymentTest(QueryBudgetMixin, TestCase):
+        def test_pay(self):
+            with self.assertQueryBudget('pay'):
+                api.pay(payment, request.build_absolute_uri)
+
+In production, set ADYEN_INSTRUMENT_QUERIES = True to log the query count and
+time of every instrumented call, and a warning for calls over budget.
+"""
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+from functools import wraps
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+log = logging.getLogger(__name__)
+
+# The maximum number of queries of each instrumented code path. The budgets
+# include the SAVEPOINT and RELEASE SAVEPOINT queries that transaction.atomic()
+# issues when called inside another transaction, as in tests.
+QUERY_BUDGETS = {
+    # insert the payment, update its merchant reference
+    'pay': 2,
+    # look up an earlier identical result, look up the payment and insert in
+    # a savepoint
+    'get_payment_result': 5,
+    # look up the original, insert, insert indexed parameters in a savepoint
+    'get_payment_notification': 5,
+    # look up the result, then the notification
+    'adyen_link': 2,
+    # get_payment_result, with the default handle_payment_result()
+    'payment_result_view': 5,
+    # get_payment_notification, with the default handle_notification()
+    'notification_view': 5,
+    # with handlers in one lane and up to batch_size notifications: fetch,
+    # claim, look up the claimed ones, mark them handled, fetch again to find
+    # nothing left. Doesn't grow with the number of notifications.
+    'process_unhandled_notifications': 5,
+    # look up the payments, insert the modifications. Doesn't grow with the
+    # number of modifications.
+    'submit_modifications': 2,
+}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecorder(object):
+    """
+    Record the queries on all databases while in this context.
+    """
+    def __init__(self, using=None):
+        self.using = using or list(connections)
+        self.queries = []
+        self.time = None
+
+    def __enter__(self):
+        self._contexts = [CaptureQueriesContext(connections[alias])
+                          for alias in self.using]
+        for context in self._contexts:
+            context.__enter__()
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.time = time.time() - self._start
+        for context in self._contexts:
+            context.__exit__(*exc_info)
+            if exc_info[0] is None:
+                self.queries.extend(context.captured_queries)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def query_time(self):
+        return sum(float(query['time']) for query in self.queries)
+
+
+def get_budget(name_or_budget):
+    """
+    Return the budget with the given name, from ADYEN_QUERY_BUDGETS if it is
+    set there and QUERY_BUDGETS otherwise.
+    """
+    if isinstance(name_or_budget, int):
+        return name_or_budget
+    return dict(QUERY_BUDGETS, **getattr(settings, 'ADYEN_QUERY_BUDGETS',
+                                         {}))[name_or_budget]
+
+
+@contextmanager
+def query_budget(name_or_budget, using=None):
+    """
+    Raise QueryBudgetExceeded if the code in this context runs more queries
+    than the budget, given as a number or a key of QUERY_BUDGETS.
+    """
+    budget = get_budget(name_or_budget)
+    with QueryRecorder(using) as recorder:
+        yield recorder
+
+    if recorder.count > budget:
+        raise QueryBudgetExceeded(
+            "{} ran {} queries, the budget is {}:\n{}".format(
+                name_or_budget, recorder.count, budget,
+                "\n".join(query['sql'] for query in recorder.queries)))
+
+
+def instrumented(name):
+    """
+    Decorator that logs the query count and time of each call if
+    ADYEN_INSTRUMENT_QUERIES is set, and warns if the call was over budget.
+    """
+    def decorator(f):
+        @wraps(f)
+        def _f(*args, **kwargs):
+            if not getattr(settings, 'ADYEN_INSTRUMENT_QUERIES', False):
+                return f(*args, **kwargs)
+
+            with QueryRecorder() as recorder:
+                result = f(*args, **kwargs)
+
+            log.debug("%s: %d queries, %.3fs in queries, %.3fs total", name,
+                      recorder.count, recorder.query_time, recorder.time)
+            budget = get_budget(name)
+            if recorder.count > budget:
+                log.warning("%s ran %d queries, the budget is %d", name,
+                            recorder.count, budget)
+            return result
+        return _f
+    return decorator
+
+
+class QueryBudgetMixin(object):
+    """
+    TestCase mixin to assert that code stays within a query budget.
+    """
+    def assertQueryBudget(self, name_or_budget, using=None):
+        return query_budget(name_or_budget, using)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from django_adyen import retention
+
+
+class Command(BaseCommand):
+    help = ("Move handled notifications and payment results older than "
+            "ADYEN_RETENTION_DAYS days into gzipped JSON lines files in "
+            "ADYEN_ARCHIVE_DIR.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help="Archive records older than this many days.")
+        parser.add_argument('--directory',
+                            help="Write archive files to this directory.")
+        parser.add_argument('--batch-size', type=int,
+                            help="Archive this many records per transaction.")
+
+    def handle(self, *args, **options):
+        older_than = None
+        if options['days'] is not None:
+            older_than = timedelta(days=options['days'])
+
+        notifications, results = retention.archive(
+            older_than=older_than, directory=options['directory'],
+            batch_size=options['batch_size'])
+
+        self.stdout.write("Archived {} notifications and {} results."
+                          .format(notifications, results))
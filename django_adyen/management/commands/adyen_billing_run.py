@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from django_adyen import recurring
+
+
+class Command(BaseCommand):
+    help = "Submit due recurring charges to Adyen."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date',
+                            type=lambda s: datetime.strptime(s, '%Y-%m-%d')
+                            .date(),
+                            help="Submit charges due on this date "
+                                 "(YYYY-MM-DD), default today.")
+        parser.add_argument('--chunk-size', type=int,
+                            help="Submit this many charges at a time.")
+        parser.add_argument('--concurrency', type=int,
+                            help="Send this many requests at the same time.")
+        parser.add_argument('--correlate-only', action='store_true',
+                            help="Only link submitted charges to their "
+                                 "AUTHORISATION notifications.")
+
+    def handle(self, *args, **options):
+        if options['correlate_only']:
+            count = recurring.correlate_notifications(options['chunk_size'])
+            self.stdout.write("Linked {} charges to notifications."
+                              .format(count))
+            return
+
+        statuses = recurring.run_billing(
+            date=options['date'], chunk_size=options['chunk_size'],
+            concurrency=options['concurrency'])
+        for status, count in sorted(statuses.items()):
+            self.stdout.write("{}: {}".format(status, count))
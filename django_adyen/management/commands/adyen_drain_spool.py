@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from django_adyen import spool
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Store the notifications accepted into the spool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            help="Store this many notifications per "
+                                 "transaction.")
+        parser.add_argument('--interval', type=float,
+                            help="Keep draining, waiting this many seconds "
+                                 "between runs.")
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                count = spool.drain(batch_size=options['batch_size'])
+            except Exception:
+                if not options['interval']:
+                    raise
+                # e.g. the database is unavailable, try again later
+                log.exception("Draining the spool failed")
+                count = 0
+
+            if count is None:
+                self.stderr.write("Another drain is in progress.")
+            elif count:
+                self.stdout.write("Stored {} notifications.".format(count))
+
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
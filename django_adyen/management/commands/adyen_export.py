@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from datetime import datetime
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from django_adyen import export
+
+
+def _parse_datetime(value):
+    for format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            value = datetime.strptime(value, format)
+        except ValueError:
+            continue
+        if settings.USE_TZ:
+            value = timezone.make_aware(value,
+                                        timezone.get_current_timezone())
+        return value
+    raise ValueError("Invalid date: {}".format(value))
+
+
+class Command(BaseCommand):
+    help = "Export payments, results or notifications."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(export.MODELS))
+        parser.add_argument('--format', default=export.CSV,
+                            choices=[export.CSV, export.JSONL,
+                                     export.PARQUET])
+        parser.add_argument('--output', default='-',
+                            help="Write to this file instead of stdout.")
+        parser.add_argument('--start', type=_parse_datetime,
+                            help="Export records created at or after this "
+                                 "date (YYYY-MM-DD[THH:MM:SS]).")
+        parser.add_argument('--end', type=_parse_datetime,
+                            help="Export records created before this date.")
+        parser.add_argument('--event-code', action='append',
+                            dest='event_codes',
+                            help="Export only notifications with this event "
+                                 "code. May be given several times.")
+        parser.add_argument('--chunk-size', type=int,
+                            help="Read this many records at a time.")
+
+    def handle(self, *args, **options):
+        if options['event_codes'] and options['kind'] != 'notifications':
+            raise CommandError("--event-code applies to notifications only.")
+
+        if options['output'] == '-':
+            fileobj = sys.stdout
+        else:
+            fileobj = open(options['output'], 'wb')
+
+        try:
+            count = export.export(
+                options['kind'], fileobj, format=options['format'],
+                start=options['start'], end=options['end'],
+                event_codes=options['event_codes'],
+                chunk_size=options['chunk_size'])
+        finally:
+            if fileobj is not sys.stdout:
+                fileobj.close()
+
+        self.stderr.write("Exported {} {}.".format(count, options['kind']))
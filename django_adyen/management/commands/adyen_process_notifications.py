@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from django_adyen import api
+from django_adyen.processing import NotificationProcessor
+
+
+class Command(BaseCommand):
+    help = ("Process unhandled notifications with the handlers registered in "
+            "django_adyen.processing.handlers.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int,
+                            help="Fetch at most this many notifications.")
+        parser.add_argument('--max-workers', type=int,
+                            help="Process at most this many notifications at "
+                                 "the same time.")
+        parser.add_argument('--poll-interval', type=float, default=5,
+                            help="Check lanes that ran out of notifications "
+                                 "again after this many seconds.")
+
+    def handle(self, *args, **options):
+        processor = NotificationProcessor(
+            max_workers=options['max_workers'],
+            poll_interval=options['poll_interval'])
+        handled = api.process_unhandled_notifications(processor,
+                                                      limit=options['limit'])
+
+        self.stdout.write("Handled {} notifications.".format(handled))
@@ -2,9 +2,26 @@
 
 from __future__ import unicode_literals
 
+from datetime import timedelta
+import hashlib
+from itertools import islice
 import json
 
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, router, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from adyen.client import (
+    RecurringAuthorisation as AdyenRecurringAuthorisation)
+
+from .backends import get_backend
+from .cache import RecentCache
+from .fields import JSONField
+
+
+def get_indexed_additional_params():
+    return getattr(settings, 'ADYEN_INDEXED_ADDITIONAL_PARAMS', [])
 
 
 class PaymentManager(models.Manager):
@@ -23,6 +40,7 @@ class PaymentManager(models.Manager):
             country_code=hosted_payment.country_code,
             shopper_email=hosted_payment.shopper_email,
             shopper_reference=hosted_payment.shopper_reference,
+            recurring_contract=hosted_payment.recurring_contract,
             allowed_methods=hosted_payment.allowed_methods,
             blocked_methods=hosted_payment.blocked_methods,
             offset=hosted_payment.offset,
@@ -77,6 +95,9 @@ class Payment(models.Model):
     shopper_email = models.CharField(max_length=254, blank=True, null=True)
     # no max length information found
     shopper_reference = models.CharField(max_length=128, blank=True, null=True)
+    # ONECLICK, RECURRING or ONECLICK,RECURRING
+    recurring_contract = models.CharField(max_length=20, blank=True,
+                                          null=True)
     allowed_methods = models.TextField(blank=True)
     blocked_methods = models.TextField(blank=True)
     offset = models.IntegerField(null=True)
@@ -99,7 +120,48 @@ class Payment(models.Model):
 
 
 class ResultManager(models.Manager):
+    def __init__(self, *args, **kwargs):
+        super(ResultManager, self).__init__(*args, **kwargs)
+        self.recent_results = RecentCache(
+            getattr(settings, 'ADYEN_RECENT_RESULTS_CACHE_SIZE', 1000))
+
     def persist(self, hosted_payment_result):
+        """
+        Store the payment result, unless the very same result was stored
+        before, in which case the existing record is returned. This happens
+        when the shopper reloads the result page.
+        """
+        # Missing psp references are stored as '' to make the unique
+        # constraint apply, NULLs never compare equal.
+        psp_reference = hosted_payment_result.psp_reference or ''
+        key = (hosted_payment_result.merchant_reference, psp_reference,
+               hosted_payment_result.merchant_sig)
+
+        result = self.recent_results.get(key)
+        if result is not None:
+            return result
+
+        lookup = dict(
+            merchant_reference=hosted_payment_result.merchant_reference,
+            psp_reference=psp_reference,
+            merchant_sig=hosted_payment_result.merchant_sig)
+        result = self.filter(**lookup).first()
+
+        if result is None:
+            using = router.db_for_write(self.model)
+            try:
+                with transaction.atomic(using=using):
+                    result = self._create(hosted_payment_result,
+                                          psp_reference)
+            except IntegrityError:
+                # a concurrent reload stored it first
+                result = self.using(using).get(**lookup)
+
+        self.recent_results.set_on_commit(key, result,
+                                          router.db_for_write(self.model))
+        return result
+
+    def _create(self, hosted_payment_result, psp_reference):
         try:
             payment = Payment.objects.get(
                 merchant_reference=hosted_payment_result.merchant_reference)
@@ -111,12 +173,13 @@ class ResultManager(models.Manager):
         return self.create(
             live=is_live,
             auth_result=hosted_payment_result.auth_result,
-            psp_reference=hosted_payment_result.psp_reference,
+            psp_reference=psp_reference,
             merchant_reference=hosted_payment_result.merchant_reference,
             skin_code=hosted_payment_result.skin_code,
             payment_method=hosted_payment_result.payment_method,
             shopper_locale=hosted_payment_result.shopper_locale,
-            merchant_return_data=hosted_payment_result.merchant_return_data)
+            merchant_return_data=hosted_payment_result.merchant_return_data,
+            merchant_sig=hosted_payment_result.merchant_sig)
 
 
 class Result(models.Model):
@@ -142,15 +205,38 @@ class Result(models.Model):
     shopper_locale = models.CharField(max_length=35)
     merchant_return_data = models.CharField(max_length=128, blank=True,
                                             null=True)
+    # base64 encoded HMAC-SHA1. Together with merchant_reference and
+    # psp_reference it identifies a result redirect, so that reloads of the
+    # result page don't create new records.
+    merchant_sig = models.CharField(max_length=28, blank=True, null=True)
 
     objects = ResultManager()
 
     class Meta:
         app_label = 'django_adyen'
+        unique_together = [
+            ('merchant_reference', 'psp_reference', 'merchant_sig')]
 
 
 class NotificationManager(models.Manager):
+    def __init__(self, *args, **kwargs):
+        super(NotificationManager, self).__init__(*args, **kwargs)
+        self.recent_notifications = RecentCache(
+            getattr(settings, 'ADYEN_RECENT_NOTIFICATIONS_CACHE_SIZE', 0))
+
     def persist(self, hosted_payment_notification):
+        """
+        Store the notification, with original set to the first record of it
+        if it's a duplicate.
+
+        If ADYEN_RECENT_NOTIFICATIONS_CACHE_SIZE is set, the originals of
+        recently stored notifications are remembered in memory. A duplicate of
+        one of those is stored without looking up its original, and an exact
+        repetition isn't stored at all. In that case the returned notification
+        is unsaved, but has original set like a stored duplicate. Notifications
+        are only remembered once they are committed, and a remembered original
+        is only used after checking by its pk that it hasn't been archived.
+        """
         notification = Notification(
             live=hosted_payment_notification.live,
             event_code=hosted_payment_notification.event_code,
@@ -166,15 +252,160 @@ class NotificationManager(models.Manager):
             reason=hosted_payment_notification.reason,
             value=hosted_payment_notification.value,
             currency=hosted_payment_notification.currency,
-            additional_params=json
-            .dumps(hosted_payment_notification.additional_params))
-        notification.original = notification.get_original()
-        notification.save()
+            additional_params=hosted_payment_notification.additional_params)
+
+        # Other processes may have stored the notification before, so only
+        # known duplicates can skip the lookup of the original.
+        key = (notification.event_code, notification.psp_reference,
+               notification.success)
+        digest = _get_notification_digest(hosted_payment_notification)
+        using = router.db_for_write(self.model)
+        recent = self.recent_notifications.get(key)
+        if (recent is not None
+                and not self.using(using).filter(pk=recent[0]).exists()):
+            # archived, maybe by another process
+            self.recent_notifications.delete(key)
+            recent = None
+        if recent is not None:
+            original_id, recent_digest = recent
+            notification.original_id = original_id
+            if digest == recent_digest:
+                # An exact repetition of a notification that was stored
+                # recently, there's nothing new to store.
+                return notification
+        else:
+            notification.original = notification.get_original()
+
+        try:
+            self._save(notification, using, savepoint=recent is not None)
+        except IntegrityError:
+            if recent is None:
+                raise
+            # the remembered original was archived in the meantime
+            self.recent_notifications.delete(key)
+            notification.original = notification.get_original()
+            self._save(notification, using)
+
+        self.recent_notifications.set_on_commit(
+            key, (notification.original_id or notification.pk, digest), using)
+
         return notification
 
+    def _save(self, notification, using, savepoint=False):
+        if savepoint or get_indexed_additional_params():
+            with transaction.atomic(using=using):
+                notification.save()
+                self._index_additional_params(
+                    [notification], get_indexed_additional_params())
+        else:
+            notification.save()
+
     def originals(self):
         return self.get_queryset().filter(original__isnull=True)
 
+    def unclaimed(self):
+        """
+        Return the unhandled original notifications that no processing run
+        has claimed, or whose claim is older than
+        ADYEN_NOTIFICATION_CLAIM_TIMEOUT seconds (default 3600).
+        """
+        expired = timezone.now() - timedelta(seconds=getattr(
+            settings, 'ADYEN_NOTIFICATION_CLAIM_TIMEOUT', 3600))
+        return self.originals().filter(
+            Q(claimed_by__isnull=True) | Q(claimed_datetime__lt=expired),
+            handled=False)
+
+    def claim(self, notifications, run):
+        """
+        Claim those of the given notifications for the processing run that
+        are unclaimed, and return them.
+        """
+        pks = [notification.pk for notification in notifications]
+        self.unclaimed().filter(pk__in=pks).update(
+            claimed_by=run, claimed_datetime=timezone.now())
+        # a replica may not have the claims yet
+        claimed = set(self.db_manager(router.db_for_write(self.model))
+                      .filter(pk__in=pks, claimed_by=run)
+                      .values_list('pk', flat=True))
+        return [notification for notification in notifications
+                if notification.pk in claimed]
+
+    def release(self, notifications, run):
+        """
+        Release the claims of the processing run on those of the given
+        notifications that are still unhandled.
+        """
+        self.filter(pk__in=[notification.pk for notification in notifications],
+                    claimed_by=run, handled=False).update(
+            claimed_by=None, claimed_datetime=None)
+
+    def with_additional_param(self, key, value):
+        """
+        Return notifications with the given additional parameter value. The
+        key must be listed in ADYEN_INDEXED_ADDITIONAL_PARAMS.
+        """
+        return self.get_queryset().filter(indexed_params__key=key,
+                                          indexed_params__value=value)
+
+    def index_additional_params(self, notifications=None, chunk_size=1000):
+        """
+        Make the additional parameters listed in
+        ADYEN_INDEXED_ADDITIONAL_PARAMS of the given saved notifications, all
+        by default, queryable through with_additional_param(). New
+        notifications are indexed by persist(), use this for existing ones.
+        Parameters that are indexed already are skipped, and so are values
+        that aren't strings of at most 255 characters.
+        """
+        keys = get_indexed_additional_params()
+        if not keys:
+            return
+
+        if notifications is None:
+            chunks = self._get_chunks(chunk_size)
+        else:
+            notifications = iter(notifications)
+            chunks = iter(lambda: list(islice(notifications, chunk_size)), [])
+
+        params = NotificationParam.objects.db_manager(
+            router.db_for_write(NotificationParam))
+        for chunk in chunks:
+            indexed = set(params.filter(
+                notification__in=[notification.pk for notification in chunk],
+                key__in=keys).values_list('notification', 'key'))
+            self._index_additional_params(chunk, keys, indexed)
+
+    def _get_chunks(self, chunk_size):
+        notifications = self.get_queryset().filter(
+            additional_params__isnull=False).order_by('pk')
+        last_pk = 0
+        while True:
+            chunk = list(notifications.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                return
+            last_pk = chunk[-1].pk
+            yield chunk
+
+    def _index_additional_params(self, notifications, keys,
+                                 indexed=frozenset()):
+        params = [
+            NotificationParam(notification=notification, key=key,
+                              value=notification.additional_params[key])
+            for notification in notifications
+            if notification.additional_params
+            for key in keys
+            if (notification.pk, key) not in indexed
+            and isinstance(notification.additional_params.get(key),
+                           basestring)
+            and len(notification.additional_params[key]) <= 255]
+        if params:
+            NotificationParam.objects.bulk_create(params)
+
+
+def _get_notification_digest(hosted_payment_notification):
+    content = json.dumps(vars(hosted_payment_notification), sort_keys=True,
+                         default=unicode)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
 
 class Notification(models.Model):
     AUTHORISATION = 'AUTHORISATION'
@@ -211,10 +442,13 @@ class Notification(models.Model):
     reason = models.TextField()
     value = models.IntegerField(null=True)
     currency = models.CharField(max_length=3, blank=True, null=True)
-    additional_params = models.TextField(blank=True, null=True)
+    additional_params = JSONField(blank=True, null=True)
 
     handled = models.BooleanField(default=False)
     original = models.ForeignKey('self', blank=True, null=True)
+    # the processing run that handles the notification
+    claimed_by = models.CharField(max_length=32, blank=True, null=True)
+    claimed_datetime = models.DateTimeField(blank=True, null=True)
 
     objects = NotificationManager()
 
@@ -250,3 +484,285 @@ class Notification(models.Model):
         return (objects.filter(event_code=self.event_code,
                                psp_reference=self.psp_reference)
                 .order_by('created_datetime').first())
+
+
+class NotificationParam(models.Model):
+    """
+    An additional parameter of a notification that is listed in
+    ADYEN_INDEXED_ADDITIONAL_PARAMS, stored separately to be able to query
+    for it efficiently.
+    """
+    notification = models.ForeignKey(Notification,
+                                     related_name='indexed_params')
+    key = models.CharField(max_length=100)
+    value = models.CharField(max_length=255)
+
+    class Meta:
+        app_label = 'django_adyen'
+        unique_together = [('notification', 'key')]
+        index_together = [('key', 'value')]
+
+
+def _get_payment_id(merchant_reference):
+    """
+    Return the payment id from a merchant reference of the format
+    ORDER_NUMBER-PAYMENT_ID, None if it doesn't have that format.
+    """
+    try:
+        return int((merchant_reference or '').split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+class ModificationManager(models.Manager):
+    def persist_all(self, modifications, is_live):
+        """
+        Store the outcome of submitted adyen.client.Modification objects. The
+        payment is determined from the reference of each modification.
+        """
+        payments = Payment.objects.in_bulk(
+            filter(None, (_get_payment_id(modification.reference)
+                          for modification in modifications)))
+
+        return self.bulk_create([
+            Modification(
+                live=is_live,
+                payment=payments.get(_get_payment_id(modification.reference)),
+                action=modification.action,
+                original_reference=modification.original_reference,
+                reference=modification.reference,
+                modification_amount=modification.amount,
+                currency=modification.currency,
+                psp_reference=modification.psp_reference,
+                response=modification.response,
+                error=modification.error)
+            for modification in modifications])
+
+
+class Modification(models.Model):
+    """
+    A modification request (capture, refund, cancel, cancelOrRefund) sent to
+    Adyen and its immediate response. Whether the modification succeeded is
+    reported later by a notification.
+    """
+    created_datetime = models.DateTimeField(auto_now_add=True)
+    live = models.BooleanField(default=None)
+    # None if the reference doesn't have the format ORDER_NUMBER-PAYMENT_ID
+    payment = models.ForeignKey(Payment, blank=True, null=True)
+
+    action = models.CharField(max_length=20)
+    # see Notification.psp_reference
+    original_reference = models.CharField(max_length=100)
+    reference = models.CharField(max_length=80, blank=True, null=True)
+    modification_amount = models.IntegerField(null=True)
+    currency = models.CharField(max_length=3, blank=True, null=True)
+
+    psp_reference = models.CharField(max_length=100, blank=True, null=True)
+    # e.g. [capture-received], None if the request failed
+    response = models.CharField(max_length=40, blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+
+    objects = ModificationManager()
+
+    class Meta:
+        app_label = 'django_adyen'
+
+
+class RecurringChargeManager(models.Manager):
+    def schedule(self, shopper_reference, amount, currency,
+                 merchant_reference, due_date, **kwargs):
+        return self.create(
+            live=get_backend().is_live,
+            shopper_reference=shopper_reference, amount=amount,
+            currency=currency, merchant_reference=merchant_reference,
+            due_date=due_date, **kwargs)
+
+    def due(self, date=None):
+        """
+        Return the pending charges that are due on date, which defaults to
+        today.
+        """
+        return self.get_queryset().filter(
+            status=RecurringCharge.PENDING,
+            due_date__lte=date or timezone.now().date())
+
+    def claim(self, charges, run):
+        """
+        Mark those of the given pending charges as submitted that no other
+        billing run has claimed yet and return them.
+        """
+        pks = [charge.pk for charge in charges]
+        self.filter(pk__in=pks, status=RecurringCharge.PENDING).update(
+            status=RecurringCharge.SUBMITTED, run=run,
+            submitted_datetime=timezone.now())
+        # a replica may not have the claims yet
+        return list(self.db_manager(router.db_for_write(self.model))
+                    .filter(pk__in=pks, run=run).order_by('pk'))
+
+    def record_outcomes(self, charges, authorisations):
+        """
+        Store the outcome of the submitted adyen.client.RecurringAuthorisation
+        objects of the given charges, in one query.
+        """
+        self.update_each({
+            charge.pk: {
+                'status': RecurringCharge.get_status(authorisation),
+                'psp_reference': authorisation.psp_reference,
+                'result_code': authorisation.result_code,
+                'refusal_reason': authorisation.refusal_reason,
+                'error': authorisation.error,
+            } for charge, authorisation in zip(charges, authorisations)})
+
+    def correlate_notifications(self, chunk_size=1000):
+        """
+        Link submitted charges to their AUTHORISATION notification, and set
+        their status according to it. Return the number of linked charges.
+
+        Charges without a psp_reference, because the outcome of their
+        submission is unknown, are matched on merchant_reference instead and
+        get the psp_reference of the notification.
+        """
+        uncorrelated = self.filter(notification__isnull=True)
+        return (
+            self._correlate(
+                uncorrelated.filter(psp_reference__isnull=False),
+                'psp_reference', chunk_size)
+            + self._correlate(
+                uncorrelated.filter(psp_reference__isnull=True,
+                                    status=RecurringCharge.SUBMITTED),
+                'merchant_reference', chunk_size))
+
+    def _correlate(self, charges, field_name, chunk_size):
+        count = 0
+        last_pk = 0
+        while True:
+            chunk = list(charges.filter(pk__gt=last_pk).order_by('pk')
+                         .values_list('pk', field_name)[:chunk_size])
+            if not chunk:
+                return count
+            last_pk = chunk[-1][0]
+
+            notifications = {}
+            for notification in (
+                    Notification.objects.originals()
+                    .filter(event_code=Notification.AUTHORISATION,
+                            **{'{}__in'.format(field_name):
+                               [value for pk, value in chunk]})
+                    .order_by('created_datetime')):
+                notifications.setdefault(getattr(notification, field_name),
+                                         notification)
+            values_by_pk = {
+                pk: {
+                    'notification': notifications[value].pk,
+                    'psp_reference': notifications[value].psp_reference,
+                    'status': (notifications[value].success
+                               and RecurringCharge.AUTHORISED
+                               or RecurringCharge.REFUSED),
+                } for pk, value in chunk if value in notifications}
+            self.update_each(values_by_pk)
+            count += len(values_by_pk)
+
+    def update_each(self, values_by_pk):
+        """
+        Update each given record with its own values in one query.
+        values_by_pk maps primary keys to dicts of field names and values.
+        """
+        if not values_by_pk:
+            return
+
+        field_names = set(name for values in values_by_pk.values()
+                          for name in values)
+        updates = {}
+        for name in field_names:
+            field = self.model._meta.get_field(name)
+            # values of relations are primary keys
+            output_field = field.rel and models.IntegerField() or field
+            updates[field.attname] = Case(
+                *[When(pk=pk, then=Value(values[name]))
+                  for pk, values in values_by_pk.items() if name in values],
+                default=F(field.attname), output_field=output_field)
+        self.filter(pk__in=list(values_by_pk)).update(**updates)
+
+
+class RecurringCharge(models.Model):
+    """
+    A charge of stored payment details of a shopper, to be submitted by a
+    billing run once it's due. Create one for each due subscription.
+
+    The status of a charge goes from pending to submitted when a billing run
+    picks it up, and to authorised, refused or error with the response to the
+    submission. Charges that stay submitted after a billing run, because the
+    response was Received or the run was interrupted, get their final status
+    from the AUTHORISATION notification. So do charges whose submission failed
+    after it was sent, with error set, as Adyen may have processed it. Charges
+    without a psp_reference are matched to the notification on
+    merchant_reference. Charges that never get one, for example because an
+    interrupted run didn't send them, need to be checked manually.
+    """
+    PENDING = 'pending'
+    SUBMITTED = 'submitted'
+    AUTHORISED = 'authorised'
+    REFUSED = 'refused'
+    ERROR = 'error'
+
+    created_datetime = models.DateTimeField(auto_now_add=True)
+    live = models.BooleanField(default=None)
+
+    # see Payment.shopper_reference
+    shopper_reference = models.CharField(max_length=128)
+    # no max length information found
+    recurring_detail_reference = models.CharField(max_length=100,
+                                                  default='LATEST')
+    amount = models.IntegerField()
+    currency = models.CharField(max_length=3)
+    # should be unique per charge
+    merchant_reference = models.CharField(max_length=80)
+    shopper_email = models.CharField(max_length=254, blank=True, null=True)
+    due_date = models.DateField()
+
+    status = models.CharField(max_length=20, default=PENDING)
+    run = models.CharField(max_length=32, blank=True, null=True)
+    submitted_datetime = models.DateTimeField(blank=True, null=True)
+    # see Notification.psp_reference
+    psp_reference = models.CharField(max_length=100, blank=True, null=True,
+                                     db_index=True)
+    result_code = models.CharField(max_length=20, blank=True, null=True)
+    refusal_reason = models.TextField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    # archiving the notification keeps the charge
+    notification = models.ForeignKey(Notification, blank=True, null=True,
+                                     on_delete=models.SET_NULL)
+
+    objects = RecurringChargeManager()
+
+    class Meta:
+        app_label = 'django_adyen'
+        index_together = [('status', 'due_date')]
+
+    @classmethod
+    def get_status(cls, authorisation):
+        if authorisation.uncertain:
+            return cls.SUBMITTED
+        if authorisation.error is not None:
+            return cls.ERROR
+        return {
+            AdyenRecurringAuthorisation.AUTHORISED: cls.AUTHORISED,
+            AdyenRecurringAuthorisation.REFUSED: cls.REFUSED,
+            AdyenRecurringAuthorisation.ERROR: cls.ERROR,
+        }.get(authorisation.result_code, cls.SUBMITTED)
+
+    def get_authorisation(self):
+        return AdyenRecurringAuthorisation(
+            self.shopper_reference, self.amount, self.currency,
+            self.merchant_reference,
+            recurring_detail_reference=self.recurring_detail_reference,
+            shopper_email=self.shopper_email,
+            idempotency_key=self.get_idempotency_key())
+
+    def get_idempotency_key(self):
+        """
+        Return a key that identifies the submission of this charge to Adyen,
+        so that retries don't charge the shopper twice.
+        """
+        return 'charge-{}-{}'.format(self.pk, hashlib.sha1(
+            self.merchant_reference.encode('utf-8')).hexdigest()[:16])
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+
+"""
+Process notifications with handlers registered per event code.
+
+Each event code belongs to a lane. Every lane has its own queue, a maximum
+number of notifications processed at the same time and a priority. Free
+workers take the next notification from the lane with the highest priority,
+unless a lower priority lane has been passed over starvation_limit times in a
+row. That way a flood of REPORT_AVAILABLE notifications doesn't delay a
+CHARGEBACK, and a flood of CHARGEBACKs doesn't stop everything else.
+
+    from django_adyen.models import Notification
+    from django_adyen.processing import handlers
+
+    @handlers.register(Notification.CHARGEBACK)
+    def handle_chargeback(notification):
+        ...
+
+A notification is marked as handled once its handler returns without raising
+an exception. The handled notifications are marked in one query before each
+fetch and at the end of the run, so a run that dies in between leaves them to
+be handled again once its claims expire. Notifications without a handler are
+left alone.
+
+process_unhandled() fetches unhandled notifications for each lane separately,
+batch_size at a time and only with the event codes that have a handler in the
+lane. A lane that ran out of notifications is checked again every
+poll_interval seconds while other lanes are still busy, so a CHARGEBACK that
+arrives during a long run is handled in that run. Notifications are claimed by
+the run before their handlers are called, so runs that overlap don't handle
+the same notification twice.
+"""
+
+from __future__ import unicode_literals
+
+from collections import deque
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connections
+
+from .models import Notification
+from .routers import use_write_database
+
+log = logging.getLogger(__name__)
+
+URGENT = 'urgent'
+DEFAULT = 'default'
+BULK = 'bulk'
+
+DEFAULT_LANES = [
+    {'name': URGENT, 'priority': 20, 'concurrency': 2},
+    {'name': DEFAULT, 'priority': 10, 'concurrency': 2},
+    {'name': BULK, 'priority': 0, 'concurrency': 1},
+]
+
+DEFAULT_EVENT_LANES = {
+    Notification.CHARGEBACK: URGENT,
+    Notification.CHARGEBACK_REVERSED: URGENT,
+    Notification.NOTIFICATION_OF_CHARGEBACK: URGENT,
+    Notification.REQUEST_FOR_INFORMATION: URGENT,
+    Notification.ADVICE_OF_DEBIT: URGENT,
+    Notification.REPORT_AVAILABLE: BULK,
+}
+
+
+class Lane(object):
+    def __init__(self, name, priority=0, concurrency=1, starvation_limit=10,
+                 batch_size=100):
+        self.name = name
+        self.priority = priority
+        self.concurrency = concurrency
+        self.starvation_limit = starvation_limit
+        self.batch_size = batch_size
+        self.pending = deque()
+        self.active = 0
+        # how often a worker took work from another lane while this one had
+        # work it could have started
+        self.skipped = 0
+        # the event codes with a handler in this lane
+        self.event_codes = []
+        # whether the last fetch found no notifications, and when it started
+        self.exhausted = False
+        self.fetched_time = None
+        self.fetching = False
+
+
+class HandlerRegistry(object):
+    def __init__(self):
+        self._handlers = {}
+
+    def register(self, event_code, lane=None):
+        """
+        Decorator to register a handler for notifications with the given event
+        code. lane defaults to the lane in ADYEN_NOTIFICATION_EVENT_LANES or
+        DEFAULT_EVENT_LANES for the event code, 'default' otherwise.
+        """
+        if lane is None:
+            lane = (getattr(settings, 'ADYEN_NOTIFICATION_EVENT_LANES',
+                            DEFAULT_EVENT_LANES)
+                    .get(event_code, DEFAULT))
+
+        def decorator(handler):
+            self._handlers[event_code] = (handler, lane)
+            return handler
+        return decorator
+
+    def get(self, event_code):
+        """
+        Return the handler and lane name for the event code, (None, None) if
+        there is no handler.
+        """
+        return self._handlers.get(event_code, (None, None))
+
+    def get_event_codes(self, lane):
+        """
+        Return the event codes with a handler in the given lane.
+        """
+        return sorted(event_code for event_code, (_, handler_lane)
+                      in self._handlers.items() if handler_lane == lane)
+
+
+handlers = HandlerRegistry()
+
+
+class NotificationProcessor(object):
+    def __init__(self, registry=None, lanes=None, max_workers=None,
+                 poll_interval=5):
+        """
+        lanes is a list of keyword argument dicts for Lane, and defaults to
+        ADYEN_NOTIFICATION_LANES or DEFAULT_LANES. max_workers defaults to
+        the sum of the lanes' concurrency, which lets every lane run at full
+        concurrency. Set it lower to make lanes compete by priority.
+        """
+        self.registry = registry or handlers
+        if lanes is None:
+            lanes = getattr(settings, 'ADYEN_NOTIFICATION_LANES',
+                            DEFAULT_LANES)
+        self.lanes = sorted((Lane(**lane) for lane in lanes),
+                            key=lambda lane: -lane.priority)
+        self._lanes_by_name = {lane.name: lane for lane in self.lanes}
+        self.max_workers = max_workers or sum(lane.concurrency
+                                              for lane in self.lanes)
+        self.poll_interval = poll_interval
+        self.run = None
+        self.handled = 0
+        self._active = 0
+        self._fetch_budget = None
+        self._failed = []
+        # the pks of handled notifications that aren't marked as handled yet
+        self._handled_pks = []
+        # when the last handler finished
+        self._finished_time = None
+        self._condition = threading.Condition()
+
+    def process(self, notifications):
+        """
+        Process the given notifications and return how many were handled.
+        Notifications that another run has claimed are skipped.
+        """
+        self._start_run(fetch_budget=0)
+        by_lane = {}
+        for notification in notifications:
+            handler, lane_name = self.registry.get(notification.event_code)
+            if handler is None:
+                log.debug("No handler for %s", notification)
+                continue
+            by_lane.setdefault(lane_name, []).append(notification)
+
+        for lane_name, lane_notifications in by_lane.items():
+            lane = self._get_lane(lane_name)
+            for i in range(0, len(lane_notifications), lane.batch_size):
+                self._enqueue(lane, Notification.objects.claim(
+                    lane_notifications[i:i + lane.batch_size], self.run))
+
+        return self._run_workers()
+
+    def process_unhandled(self, limit=None):
+        """
+        Process unhandled notifications, the oldest of each lane first, until
+        there are none left, and return how many were handled. limit is the
+        maximum number of notifications to fetch.
+        """
+        self._start_run(fetch_budget=limit)
+        return self._run_workers()
+
+    def _start_run(self, fetch_budget):
+        self.run = uuid.uuid4().hex
+        self.handled = 0
+        self._fetch_budget = fetch_budget
+        self._failed = []
+        self._handled_pks = []
+        self._finished_time = time.time()
+        for lane in self.lanes:
+            lane.pending.clear()
+            lane.event_codes = self.registry.get_event_codes(lane.name)
+            lane.exhausted = False
+            lane.fetched_time = None
+
+    def _run_workers(self):
+        try:
+            if self.max_workers == 1:
+                self._work(close_connections=False)
+            else:
+                workers = [threading.Thread(target=self._work)
+                           for _ in range(self.max_workers)]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+        finally:
+            self._mark_handled()
+            # Failed notifications stay claimed until the end of the run so
+            # that they aren't fetched again by it. Let the next run retry
+            # them, and have what is left in case a worker died.
+            left = self._failed + [notification for lane in self.lanes
+                                   for _, notification in lane.pending]
+            if left:
+                Notification.objects.release(left, self.run)
+
+        return self.handled
+
+    def _get_lane(self, name):
+        try:
+            return self._lanes_by_name[name]
+        except KeyError:
+            raise ValueError("Unknown notification lane '{}'".format(name))
+
+    def _enqueue(self, lane, notifications):
+        for notification in notifications:
+            handler, _ = self.registry.get(notification.event_code)
+            lane.pending.append((handler, notification))
+
+    def _fetch(self, lane, size):
+        """
+        Claim and return up to size of the oldest unhandled notifications of
+        the lane.
+        """
+        notifications = list(
+            Notification.objects.unclaimed()
+            .filter(event_code__in=lane.event_codes)
+            .order_by('created_datetime')[:size])
+        return Notification.objects.claim(notifications, self.run)
+
+    def _mark_handled(self):
+        with self._condition:
+            pks, self._handled_pks = self._handled_pks, []
+        if pks:
+            Notification.objects.filter(pk__in=pks).update(handled=True)
+
+    def _work(self, close_connections=True):
+        try:
+            with use_write_database():
+                while True:
+                    task = self._take()
+                    if task is None:
+                        return
+                    self._handle(*task)
+        finally:
+            if close_connections:
+                for connection in connections.all():
+                    connection.close()
+
+    def _handle(self, lane, handler, notification):
+        try:
+            handler(notification)
+        except Exception:
+            log.exception("Handling %s failed", notification)
+            with self._condition:
+                self._failed.append(notification)
+        else:
+            with self._condition:
+                self._handled_pks.append(notification.pk)
+                self.handled += 1
+        finally:
+            with self._condition:
+                lane.active -= 1
+                self._active -= 1
+                self._finished_time = time.time()
+                self._condition.notify_all()
+
+    def _take(self):
+        """
+        Wait for a notification that may be started and return it with its
+        lane and handler, fetching more notifications for empty lanes. Return
+        None once there is nothing left to start.
+        """
+        while True:
+            with self._condition:
+                while True:
+                    lane = self._choose_lane()
+                    if lane is not None:
+                        handler, notification = lane.pending.popleft()
+                        lane.active += 1
+                        self._active += 1
+                        return lane, handler, notification
+
+                    if self._is_done():
+                        return None
+
+                    lane, size = self._choose_lane_to_fetch()
+                    if lane is not None:
+                        lane.fetching = True
+                        lane.fetched_time = time.time()
+                        break
+
+                    self._condition.wait(self.poll_interval or None)
+
+            notifications = []
+            try:
+                self._mark_handled()
+                notifications = self._fetch(lane, size)
+            finally:
+                with self._condition:
+                    lane.fetching = False
+                    lane.exhausted = not notifications
+                    if self._fetch_budget is not None:
+                        self._fetch_budget -= len(notifications)
+                    self._enqueue(lane, notifications)
+                    self._condition.notify_all()
+
+    def _choose_lane(self):
+        if self._active >= self.max_workers:
+            return None
+
+        startable = [lane for lane in self.lanes
+                     if lane.pending and lane.active < lane.concurrency]
+        if not startable:
+            return None
+
+        starving = [lane for lane in startable
+                    if lane.skipped >= lane.starvation_limit]
+        chosen = (starving or startable)[0]
+
+        for lane in startable:
+            lane.skipped += 1
+        chosen.skipped = 0
+
+        return chosen
+
+    def _choose_lane_to_fetch(self):
+        """
+        Return the lane with the highest priority that should fetch more
+        notifications and how many, (None, None) if none should.
+
+        A lane that ran out fetches again once handlers finished since, after
+        poll_interval seconds or as soon as nothing else is left to do.
+        """
+        if self._fetch_budget is not None and self._fetch_budget <= 0:
+            return None, None
+
+        idle = self._active == 0 and not any(lane.pending
+                                             for lane in self.lanes)
+        now = time.time()
+        for lane in self.lanes:
+            if not lane.event_codes or lane.pending or lane.fetching:
+                continue
+            if lane.exhausted and (
+                    lane.fetched_time > self._finished_time
+                    or not idle
+                    and now - lane.fetched_time < self.poll_interval):
+                continue
+
+            size = lane.batch_size
+            if self._fetch_budget is not None:
+                size = min(size, self._fetch_budget)
+            return lane, size
+
+        return None, None
+
+    def _is_done(self):
+        """
+        Whether nothing is left to start or being worked on, and every lane
+        found no notifications after the last handler finished.
+        """
+        if (self._active
+                or any(lane.pending or lane.fetching for lane in self.lanes)):
+            return False
+        if self._fetch_budget is not None and self._fetch_budget <= 0:
+            return True
+        return all(lane.exhausted and lane.fetched_time > self._finished_time
+                   for lane in self.lanes if lane.event_codes)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+Billing runs, which submit due recurring charges to Adyen.
+
+Due charges are processed in chunks. Each chunk is claimed, so that
+concurrent runs don't submit the same charge twice, submitted concurrently
+through the shared webservice client, which limits the request rate if
+ADYEN_WEBSERVICE_RATE is set, and its outcome is stored in one query.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import uuid
+
+from django.conf import settings
+
+from .api import get_payment_client
+from .models import RecurringCharge
+from .routers import uses_write_database
+
+log = logging.getLogger(__name__)
+
+
+def get_chunk_size():
+    return getattr(settings, 'ADYEN_BILLING_CHUNK_SIZE', 500)
+
+
+@uses_write_database
+def run_billing(date=None, chunk_size=None, concurrency=None):
+    """
+    Submit all charges due on date, which defaults to today, then link
+    submitted charges to their AUTHORISATION notifications. Return the number
+    of charges per resulting status.
+    """
+    client = get_payment_client()
+    chunk_size = chunk_size or get_chunk_size()
+    run = uuid.uuid4().hex
+    due_charges = RecurringCharge.objects.due(date)
+
+    statuses = {}
+    last_pk = 0
+    while True:
+        chunk = list(due_charges.filter(pk__gt=last_pk).order_by('pk')
+                     [:chunk_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1].pk
+
+        charges = RecurringCharge.objects.claim(chunk, run)
+        authorisations = client.submit_all(
+            [charge.get_authorisation() for charge in charges],
+            concurrency=concurrency)
+        RecurringCharge.objects.record_outcomes(charges, authorisations)
+
+        for authorisation in authorisations:
+            status = RecurringCharge.get_status(authorisation)
+            statuses[status] = statuses.get(status, 0) + 1
+        log.info("Billing run %s: %s", run, statuses)
+
+    correlate_notifications()
+
+    return statuses
+
+
+@uses_write_database
+def correlate_notifications(chunk_size=None):
+    return RecurringCharge.objects.correlate_notifications(
+        chunk_size or get_chunk_size())
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+"""
+Move old records out of the Notification and Result tables into gzipped JSON
+lines files, so that the hot tables stay small.
+
+Records are processed in batches. Each batch is locked, written to the archive
+file as a separate gzip member, fsynced and deleted in one short transaction,
+so an interrupted run at worst leaves records both archived and in the table.
+Those are archived again by the next run, and decompressing the file yields
+all complete batches.
+"""
+
+from __future__ import unicode_literals
+
+from datetime import timedelta
+import gzip
+import json
+import logging
+import os
+
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, router, transaction
+from django.utils import timezone
+
+from .models import Notification, NotificationParam, Result
+from .routers import uses_write_database
+
+log = logging.getLogger(__name__)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def get_archive_dir():
+    return settings.ADYEN_ARCHIVE_DIR
+
+
+def get_retention_days():
+    return getattr(settings, 'ADYEN_RETENTION_DAYS', 90)
+
+
+def get_batch_size():
+    return getattr(settings, 'ADYEN_RETENTION_BATCH_SIZE', 1000)
+
+
+def archive(older_than=None, directory=None, batch_size=None):
+    """
+    Archive handled notifications and results older than older_than, a
+    timedelta, which defaults to ADYEN_RETENTION_DAYS days. Return the
+    number of archived notifications and results.
+    """
+    if older_than is None:
+        older_than = timedelta(days=get_retention_days())
+    cutoff = timezone.now() - older_than
+
+    return (archive_notifications(cutoff, directory, batch_size),
+            archive_results(cutoff, directory, batch_size))
+
+
+@uses_write_database
+def archive_notifications(before, directory=None, batch_size=None):
+    """
+    Archive handled notifications created before the given datetime. The
+    duplicates of an archived notification are archived along with it,
+    regardless of their age.
+    """
+    batch_size = batch_size or get_batch_size()
+    originals = (Notification.objects.originals()
+                 .filter(handled=True, created_datetime__lt=before))
+
+    count = 0
+    with _ArchiveFile(Notification, directory) as archive_file:
+        while True:
+            with transaction.atomic(using=router.db_for_write(Notification)):
+                pks = list(originals.select_for_update().order_by('pk')
+                           .values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    break
+
+                notifications = list(
+                    Notification.objects.select_for_update()
+                    .filter(models.Q(pk__in=pks) | models.Q(original__in=pks))
+                    .order_by('pk'))
+                archived = [n.pk for n in notifications]
+                # the indexed parameters are part of additional_params
+                _check_unreferenced(Notification, archived,
+                                    ignore=[NotificationParam])
+
+                archive_file.write(notifications)
+
+                NotificationParam.objects.filter(
+                    notification__in=archived).delete()
+                Notification.objects.filter(pk__in=archived).delete()
+
+            count += len(notifications)
+            log.info("Archived %d notifications", count)
+
+    # originals are cached by NotificationManager.persist
+    Notification.objects.recent_notifications.clear()
+
+    return count
+
+
+@uses_write_database
+def archive_results(before, directory=None, batch_size=None):
+    """
+    Archive results created before the given datetime.
+    """
+    batch_size = batch_size or get_batch_size()
+    old_results = Result.objects.filter(created_datetime__lt=before)
+
+    count = 0
+    with _ArchiveFile(Result, directory) as archive_file:
+        while True:
+            with transaction.atomic(using=router.db_for_write(Result)):
+                results = list(old_results.select_for_update()
+                               .order_by('pk')[:batch_size])
+                if not results:
+                    break
+
+                archived = [r.pk for r in results]
+                _check_unreferenced(Result, archived)
+
+                archive_file.write(results)
+
+                Result.objects.filter(pk__in=archived).delete()
+
+            count += len(results)
+            log.info("Archived %d results", count)
+
+    # results are cached by ResultManager.persist
+    Result.objects.recent_results.clear()
+
+    return count
+
+
+def _check_unreferenced(model, pks, ignore=()):
+    """
+    Raise ArchiveError if records that are not archived would be deleted along
+    with the records of the model with the given primary keys. Relations from
+    the models in ignore are not checked.
+    """
+    for relation in model._meta.related_objects:
+        if (relation.related_model in ignore
+                or relation.on_delete is not models.CASCADE):
+            continue
+
+        referring = relation.related_model._default_manager.filter(
+            **{'{}__in'.format(relation.field.name): pks})
+        if relation.related_model is model:
+            referring = referring.exclude(pk__in=pks)
+        if referring.exists():
+            raise ArchiveError(
+                "Not archiving {}, other {} records refer to them".format(
+                    model._meta.verbose_name_plural,
+                    relation.related_model._meta.verbose_name))
+
+
+class _ArchiveFile(object):
+    """
+    A gzipped JSON lines file with one serialized record per line. The file is
+    only created once the first record is written. Each write() appends a
+    complete gzip member and fsyncs the file.
+    """
+    def __init__(self, model, directory=None):
+        self.model = model
+        self.directory = directory or get_archive_dir()
+        self.path = os.path.join(
+            self.directory, '{name}-{timestamp}.jsonl.gz'.format(
+                name=model._meta.model_name,
+                timestamp=timezone.now().strftime('%Y%m%dT%H%M%S')))
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            self._file.close()
+
+    def write(self, objects):
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+            _fsync_directory(self.directory)
+
+        member = gzip.GzipFile(fileobj=self._file, mode='wb')
+        for data in serializers.serialize('python', objects):
+            line = json.dumps(data, cls=DjangoJSONEncoder) + '\n'
+            member.write(line.encode('utf-8'))
+        member.close()
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+def _fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
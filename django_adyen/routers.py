@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""
+A database router that sends django_adyen writes to ADYEN_WRITE_DATABASE and
+reads to one of ADYEN_READ_DATABASES.
+
+Enable it in the settings:
+
+    DATABASE_ROUTERS = ['django_adyen.routers.AdyenRouter']
+    ADYEN_WRITE_DATABASE = 'payments'
+    ADYEN_READ_DATABASES = ['payments_replica']
+
+Code that has to read what it just wrote, like the payment result redirect,
+runs inside use_write_database(), which makes reads use the write database
+as well.
+"""
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+from functools import wraps
+import random
+import threading
+
+from django.conf import settings
+
+APP_LABEL = 'django_adyen'
+
+_state = threading.local()
+
+
+def get_write_database():
+    return getattr(settings, 'ADYEN_WRITE_DATABASE', None)
+
+
+def get_read_databases():
+    return getattr(settings, 'ADYEN_READ_DATABASES', [])
+
+
+@contextmanager
+def use_write_database():
+    """
+    Read django_adyen models from the write database while in this context.
+    """
+    previous = getattr(_state, 'pinned', False)
+    _state.pinned = True
+    try:
+        yield
+    finally:
+        _state.pinned = previous
+
+
+def uses_write_database(f):
+    @wraps(f)
+    def _f(*args, **kwargs):
+        with use_write_database():
+            return f(*args, **kwargs)
+    return _f
+
+
+class AdyenRouter(object):
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return None
+
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+
+        read_databases = get_read_databases()
+        if getattr(_state, 'pinned', False) or not read_databases:
+            return get_write_database()
+
+        return random.choice(read_databases)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return None
+
+        return get_write_database()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if (obj1._meta.app_label == APP_LABEL
+                and obj2._meta.app_label == APP_LABEL):
+            return True
+
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        write_database = get_write_database()
+        if app_label != APP_LABEL or write_database is None:
+            return None
+
+        return db == write_database
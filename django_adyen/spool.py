@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+
+"""
+Accept notifications without touching the database by appending them to a
+local spool, and store them as Notification records later.
+
+The spool is a directory of segment files with one JSON record per line. Every
+record is fsynced before the notification is acknowledged. Records are only
+appended to the newest segment, which is replaced by a new one once it has
+grown beyond ADYEN_SPOOL_SEGMENT_SIZE bytes.
+
+drain() reads the records in batches and stores each batch in one
+transaction. Records that can't be stored, because they are invalid or the
+database rejects them, are moved to the dead letter file dead-letter.log in
+the spool directory instead of failing the batch. After a batch is committed,
+the offset up to which the segment has been processed is saved next to it. If
+the drainer crashes between the two steps, the batch is stored again on the
+next run and ends up as duplicates of the first records. Fully processed
+segments except the newest are deleted.
+"""
+
+from __future__ import unicode_literals
+
+import base64
+from datetime import datetime
+import fcntl
+import json
+import logging
+import os
+import re
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, router, transaction
+from django.http import QueryDict
+
+from adyen import check_basic_auth
+
+from . import api as django_adyen_api
+from .backends import get_backend
+from .models import Notification
+
+log = logging.getLogger(__name__)
+
+SEGMENT_RE = re.compile(r'^spool-(\d{12})\.log$')
+
+DEAD_LETTER_FILE = 'dead-letter.log'
+
+
+class Spool(object):
+    def __init__(self, directory, segment_size=16 * 1024 * 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory,
+                            'spool-{:012d}.log'.format(number))
+
+    def _offset_path(self, segment_path):
+        return segment_path + '.offset'
+
+    def segments(self):
+        """
+        Return the paths of all segments, oldest first.
+        """
+        return [os.path.join(self.directory, name)
+                for name in sorted(os.listdir(self.directory))
+                if SEGMENT_RE.match(name)]
+
+    def append(self, body):
+        """
+        Durably append a raw notification request body to the spool.
+        """
+        record = json.dumps({
+            'received': datetime.utcnow().isoformat(),
+            'body': base64.b64encode(body),
+        }) + '\n'
+
+        with open(os.path.join(self.directory, 'spool.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            segments = self.segments()
+            if segments:
+                path = segments[-1]
+                if os.path.getsize(path) >= self.segment_size:
+                    number = int(SEGMENT_RE.match(
+                        os.path.basename(path)).group(1))
+                    path = self._segment_path(number + 1)
+            else:
+                path = self._segment_path(0)
+
+            created = not os.path.exists(path)
+            with open(path, 'ab+') as segment:
+                # terminate a record that was cut short by a crash, so that
+                # it doesn't spoil this one
+                if segment.tell() > 0:
+                    segment.seek(-1, os.SEEK_END)
+                    if segment.read(1) != b'\n':
+                        record = '\n' + record
+                segment.write(record.encode('utf-8'))
+                segment.flush()
+                os.fsync(segment.fileno())
+            if created:
+                _fsync_directory(self.directory)
+
+    def read_offset(self, segment_path):
+        try:
+            with open(self._offset_path(segment_path)) as f:
+                return int(f.read())
+        except IOError:
+            return 0
+
+    def write_offset(self, segment_path, offset):
+        path = self._offset_path(segment_path)
+        with open(path + '.tmp', 'w') as f:
+            f.write('{}'.format(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(path + '.tmp', path)
+        _fsync_directory(self.directory)
+
+    def write_dead_letters(self, failed):
+        """
+        Durably append the records that couldn't be processed, given as
+        (record, error) tuples, to the dead letter file.
+        """
+        path = os.path.join(self.directory, DEAD_LETTER_FILE)
+        created = not os.path.exists(path)
+        with open(path, 'ab') as f:
+            for record, error in failed:
+                f.write((json.dumps({
+                    'received': record['received'],
+                    'failed': datetime.utcnow().isoformat(),
+                    'error': '{}: {}'.format(type(error).__name__, error),
+                    'body': base64.b64encode(record['body']),
+                }) + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        if created:
+            _fsync_directory(self.directory)
+
+    def drain(self, handle_batch, batch_size=100):
+        """
+        Call handle_batch with lists of up to batch_size unprocessed records,
+        each a dict with the received timestamp and the raw body.
+        handle_batch returns the records it couldn't process as (record,
+        error) tuples, which are written to the dead letter file. Return the
+        number of processed records, None if another drain is in progress.
+        """
+        with open(os.path.join(self.directory, 'drain.lock'), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return None
+            return self._drain(handle_batch, batch_size)
+
+    def _drain(self, handle_batch, batch_size):
+        count = 0
+        segments = self.segments()
+        for segment_path in segments:
+            offset = self.read_offset(segment_path)
+            with open(segment_path, 'rb') as segment:
+                segment.seek(offset)
+                while True:
+                    lines = []
+                    while len(lines) < batch_size:
+                        line = segment.readline()
+                        if not line.endswith(b'\n'):
+                            # the end, or a record that is being written
+                            break
+                        lines.append(line)
+                    if not lines:
+                        break
+
+                    failed = handle_batch(
+                        filter(None, map(self._decode, lines)))
+                    if failed:
+                        self.write_dead_letters(failed)
+                    offset += sum(len(line) for line in lines)
+                    self.write_offset(segment_path, offset)
+                    count += len(lines)
+
+            if (segment_path != segments[-1]
+                    and offset >= os.path.getsize(segment_path)):
+                os.remove(segment_path)
+                os.remove(self._offset_path(segment_path))
+
+        return count
+
+    @staticmethod
+    def _decode(line):
+        try:
+            record = json.loads(line)
+            record['body'] = base64.b64decode(record['body'])
+        except (KeyError, TypeError, ValueError):
+            if line.strip():
+                log.error("Skipping invalid spool record: %r", line)
+            return None
+        return record
+
+
+def get_spool():
+    return Spool(settings.ADYEN_SPOOL_DIR,
+                 getattr(settings, 'ADYEN_SPOOL_SEGMENT_SIZE',
+                         16 * 1024 * 1024))
+
+
+def is_notification(body):
+    """
+    Whether the request body looks like a notification, so that it's worth
+    spooling.
+    """
+    return bool(body) and 'eventCode' in QueryDict(body)
+
+
+def store_notifications(records):
+    """
+    Store the spooled notifications as Notification records in one
+    transaction, each in its own savepoint. Return the records that couldn't
+    be stored with the error, as (record, error) tuples. Errors that aren't
+    specific to a record, like a lost database connection, are raised.
+    """
+    failed = []
+    using = router.db_for_write(Notification)
+    with transaction.atomic(using=using):
+        for record in records:
+            params = QueryDict(record['body'])
+            try:
+                with transaction.atomic(using=using):
+                    django_adyen_api.get_payment_notification(params)
+            except (KeyError, ValueError, DataError, IntegrityError) as e:
+                log.exception("Failed to store the notification received "
+                              "at %s: %r", record['received'], record['body'])
+                failed.append((record, e))
+    return failed
+
+
+def drain(batch_size=None):
+    """
+    Store all spooled notifications. Return how many were processed, None if
+    another drain is in progress.
+    """
+    return get_spool().drain(
+        store_notifications,
+        batch_size or getattr(settings, 'ADYEN_SPOOL_BATCH_SIZE', 100))
+
+
+class SpoolIntakeApplication(object):
+    """
+    A WSGI application that accepts notifications into the spool, without
+    going through Django's request handling.
+    """
+    def __init__(self, spool=None, credentials=None):
+        self.spool = spool or get_spool()
+        self.credentials = (credentials
+                            or get_backend().get_notification_credentials())
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'POST':
+            start_response(b'405 Method Not Allowed',
+                           [(b'Allow', b'POST')])
+            return [b'']
+
+        if not check_basic_auth(environ.get('HTTP_AUTHORIZATION'),
+                                self.credentials):
+            start_response(b'401 Unauthorized',
+                           [(b'WWW-Authenticate',
+                             b'Basic realm="restricted area"')])
+            return [b'']
+
+        body = self._read_body(environ)
+        if not is_notification(body):
+            start_response(b'400 Bad Request',
+                           [(b'Content-Type', b'text/plain')])
+            return [b'Not a notification']
+
+        self.spool.append(body)
+
+        start_response(b'200 OK', [(b'Content-Type', b'text/plain')])
+        return [b'[accepted]']
+
+    @staticmethod
+    def _read_body(environ):
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if not length and environ.get('wsgi.input_terminated'):
+            # chunked, the server marks the end of the input
+            return environ['wsgi.input'].read()
+        return environ['wsgi.input'].read(length)
+
+
+def _fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -2,6 +2,7 @@
 
 from django import template
 
+from django_adyen.instrumentation import instrumented
 from django_adyen.models import Result, Notification
 
 register = template.Library()
@@ -9,6 +10,12 @@ register = template.Library()
 
 @register.simple_tag()
 def adyen_link(psp_reference):
+    # simple_tag() inspects the signature, so don't decorate the tag itself
+    return _adyen_link(psp_reference)
+
+
+@instrumented('adyen_link')
+def _adyen_link(psp_reference):
     try:
         result = Result.objects.get(psp_reference=psp_reference)
         is_live = result.live
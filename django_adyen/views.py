@@ -2,18 +2,21 @@
 
 from __future__ import unicode_literals
 
-import base64
 from functools import wraps
 import logging
 
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import (HttpResponse, HttpResponseBadRequest,
+                         HttpResponseRedirect)
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 
 from .backends import get_backend
 
 from . import api as django_adyen_api
-from adyen import is_old_browser
+from .instrumentation import instrumented
+from .routers import use_write_database
+from .spool import get_spool, is_notification
+from adyen import check_basic_auth, is_old_browser
 
 log = logging.getLogger(__name__)
 
@@ -28,9 +31,13 @@ class PaymentRequestMixin(object):
 
 
 class PaymentResultView(View):
+    @instrumented('payment_result_view')
     def get(self, request):
-        payment_result = django_adyen_api.get_payment_result(request.GET)
-        return self.handle_payment_result(payment_result)
+        # handle_payment_result() may read what was just written, so don't
+        # read from a replica that might lag behind.
+        with use_write_database():
+            payment_result = django_adyen_api.get_payment_result(request.GET)
+            return self.handle_payment_result(payment_result)
 
     def handle_payment_result(self, payment_result):
         return HttpResponse('Payment {}.'.format(payment_result.auth_result))
@@ -45,22 +52,11 @@ def basic_auth(f):
         please_authorize_response['WWW-Authenticate'] \
             = 'Basic realm="restricted area"'
 
-        if 'HTTP_AUTHORIZATION' not in request.META:
-            return please_authorize_response
-
-        auth = request.META['HTTP_AUTHORIZATION'].split()
-        if len(auth) != 2:
-            return please_authorize_response
-
-        if auth[0].lower() != "basic":
-            return please_authorize_response
-
         backend = get_backend()
         credentials = backend.get_notification_credentials()
 
-        user, password = base64.b64decode(auth[1]).split(':', 1)
-
-        if (user, password) != credentials:
+        if not check_basic_auth(request.META.get('HTTP_AUTHORIZATION'),
+                                credentials):
             return please_authorize_response
 
         return f(self, request, *args, **kwargs)
@@ -72,6 +68,7 @@ class NotificationView(View):
     def dispatch(self, *args, **kwargs):
         return super(NotificationView, self).dispatch(*args, **kwargs)
 
+    @instrumented('notification_view')
     @basic_auth
     def post(self, request):
         notification = django_adyen_api.get_payment_notification(
@@ -93,3 +90,20 @@ class NotificationView(View):
         is the first notification record for duplicates.
         """
         return HttpResponse('[accepted]')
+
+
+class SpoolNotificationView(View):
+    """
+    Accept notifications into the spool without touching the database. Run
+    the adyen_drain_spool management command to store them.
+    """
+    @csrf_exempt
+    def dispatch(self, *args, **kwargs):
+        return super(SpoolNotificationView, self).dispatch(*args, **kwargs)
+
+    @basic_auth
+    def post(self, request):
+        if not is_notification(request.body):
+            return HttpResponseBadRequest('Not a notification')
+        get_spool().append(request.body)
+        return HttpResponse('[accepted]')
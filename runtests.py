@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run the tests with ./runtests.py [test labels].
+"""
+
+import os
+import sys
+
+import django
+from django.conf import settings
+from django.test.utils import get_runner
+
+if __name__ == '__main__':
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'tests.settings'
+    django.setup()
+    test_runner = get_runner(settings)()
+    failures = test_runner.run_tests(sys.argv[1:] or ['tests'])
+    sys.exit(bool(failures))
@@ -7,5 +7,7 @@ setup(name='adyen',
       author='Markus Bertheau',
       author_email='mbertheau@gmail.com',
       long_description=open('README.md').read(),
-      packages=['adyen', 'django_adyen', 'django_adyen.templatetags'],
+      packages=['adyen', 'django_adyen', 'django_adyen.management',
+                'django_adyen.management.commands',
+                'django_adyen.templatetags'],
       install_requires=['pytz', 'zope.dottedname'])
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+SECRET_KEY = 'secret'
+
+INSTALLED_APPS = [
+    'django_adyen',
+]
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+    # a replica that never catches up, for the tests of AdyenRouter
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'redirects': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'redirects',
+    },
+}
+
+ROOT_URLCONF = 'tests.urls'
+
+USE_TZ = True
+
+ADYEN_MERCHANT_ACCOUNT = 'MerchantAccount'
+ADYEN_SKIN_CODE = 'aKhNrM6V'
+ADYEN_SKIN_SECRET = b'secret'
+ADYEN_NOTIFICATION_USER = 'user'
+ADYEN_NOTIFICATION_PASSWORD = 'password'
+ADYEN_WEBSERVICE_USER = 'ws@Company.Company'
+ADYEN_WEBSERVICE_PASSWORD = 'password'
+
+LOGGING = {
+    'version': 1,
+    'handlers': {
+        'null': {'class': 'logging.NullHandler'},
+    },
+    'loggers': {
+        'adyen': {'handlers': ['null'], 'propagate': False},
+        'django_adyen': {'handlers': ['null'], 'propagate': False},
+    },
+}
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+A local stand-in for the Adyen payment webservice, to test the client against
+a real HTTP server.
+"""
+
+from __future__ import unicode_literals
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import json
+from SocketServer import ThreadingMixIn
+import threading
+import time
+
+# a scripted response that closes the connection without answering
+DROP = 'drop'
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep connections alive
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.stand_in.lock:
+            self.server.stand_in.connections += 1
+
+    def do_POST(self):
+        stand_in = self.server.stand_in
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        action = self.path.rsplit('/', 1)[-1]
+        with stand_in.lock:
+            stand_in.requests.append({
+                'time': time.time(),
+                'action': action,
+                'headers': dict(self.headers),
+                'data': json.loads(body),
+            })
+            if stand_in.responses:
+                response = stand_in.responses.pop(0)
+            else:
+                response = (200, stand_in.get_default_response(
+                    action, len(stand_in.requests)))
+
+        if response == DROP:
+            self.close_connection = True
+            return
+
+        status, data = response
+        content = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '{}'.format(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandIn(object):
+    """
+    Answers each request with the next of the scripted responses, a (status,
+    data) tuple or DROP, and successfully once they are used up. Records the
+    requests and counts the connections.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+        self.responses = []
+        self.connections = 0
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.stand_in = self
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.01})
+        self._thread.daemon = True
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/pal/servlet/Payment/v12/'.format(
+            self._server.server_address[1])
+
+    def get_default_response(self, action, number):
+        psp_reference = '{:016d}'.format(number)
+        if action == 'authorise':
+            return {'pspReference': psp_reference, 'resultCode': 'Authorised'}
+        return {'pspReference': psp_reference,
+                'response': '[{}-received]'.format(action)}
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import socket
+import time
+import unittest
+
+from adyen.client import Modification, PaymentClient, RateLimiter
+
+from .stand_in import DROP, StandIn
+
+
+def capture(reference='order-1', **kwargs):
+    return Modification(Modification.CAPTURE, '8514000000000001', 1000, 'EUR',
+                        reference, **kwargs)
+
+
+def get_unused_url():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return 'http://127.0.0.1:{}/pal/servlet/Payment/v12/'.format(port)
+
+
+class PaymentClientTest(unittest.TestCase):
+    def setUp(self):
+        self.stand_in = StandIn().start()
+        self.addCleanup(self.stand_in.stop)
+
+    def get_client(self, **kwargs):
+        kwargs.setdefault('retry_delay', 0)
+        client = PaymentClient('MerchantAccount', 'ws', 'password',
+                               url=kwargs.pop('url', self.stand_in.url),
+                               **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_submit(self):
+        modification = self.get_client().submit(capture())
+
+        self.assertTrue(modification.accepted)
+        self.assertEqual(modification.psp_reference, '0000000000000001')
+        request, = self.stand_in.requests
+        self.assertEqual(request['action'], 'capture')
+        self.assertEqual(request['data'], {
+            'merchantAccount': 'MerchantAccount',
+            'originalReference': '8514000000000001',
+            'reference': 'order-1',
+            'modificationAmount': {'value': 1000, 'currency': 'EUR'},
+        })
+        self.assertEqual(request['headers']['idempotency-key'],
+                         'order-1-capture')
+
+    def test_connections_are_kept_alive(self):
+        client = self.get_client(pool_size=1)
+        for i in range(3):
+            client.submit(capture('order-{}'.format(i)))
+
+        self.assertEqual(len(self.stand_in.requests), 3)
+        self.assertEqual(self.stand_in.connections, 1)
+
+    def test_pool_size_limits_connections(self):
+        client = self.get_client(pool_size=2)
+        client.submit_all([capture('order-{}'.format(i)) for i in range(10)],
+                          concurrency=4)
+
+        self.assertEqual(len(self.stand_in.requests), 10)
+        self.assertLessEqual(self.stand_in.connections, 2)
+
+    def test_dropped_connection_is_replaced(self):
+        self.stand_in.responses = [DROP]
+        client = self.get_client(pool_size=1)
+        client.submit(capture('order-1'))
+        modification = client.submit(capture('order-2'))
+
+        self.assertTrue(modification.accepted)
+        self.assertEqual(self.stand_in.connections, 2)
+
+    def test_server_error_is_retried_with_idempotency_key(self):
+        self.stand_in.responses = [(500, {}), (503, {})]
+        modification = self.get_client().submit(capture())
+
+        self.assertTrue(modification.accepted)
+        self.assertEqual(
+            [r['headers']['idempotency-key'] for r in self.stand_in.requests],
+            ['order-1-capture'] * 3)
+
+    def test_dropped_connection_is_retried_with_idempotency_key(self):
+        self.stand_in.responses = [DROP]
+        modification = self.get_client().submit(capture())
+
+        self.assertTrue(modification.accepted)
+        self.assertEqual(len(self.stand_in.requests), 2)
+
+    def test_server_error_is_not_retried_without_idempotency_key(self):
+        self.stand_in.responses = [(500, {})]
+        modification = self.get_client().submit(capture(reference=None))
+
+        self.assertFalse(modification.accepted)
+        self.assertTrue(modification.uncertain)
+        self.assertEqual(modification.error, 'HTTP 500: {}')
+        request, = self.stand_in.requests
+        self.assertNotIn('idempotency-key', request['headers'])
+
+    def test_dropped_connection_is_not_retried_without_idempotency_key(self):
+        self.stand_in.responses = [DROP]
+        modification = self.get_client().submit(capture(reference=None))
+
+        self.assertTrue(modification.uncertain)
+        self.assertEqual(len(self.stand_in.requests), 1)
+
+    def test_retries_are_limited(self):
+        self.stand_in.responses = [(500, {})] * 5
+        modification = self.get_client(retries=2).submit(capture())
+
+        self.assertTrue(modification.uncertain)
+        self.assertEqual(len(self.stand_in.requests), 3)
+
+    def test_too_many_requests_are_retried(self):
+        self.stand_in.responses = [(429, {})]
+        modification = self.get_client().submit(capture(reference=None))
+
+        self.assertTrue(modification.accepted)
+        self.assertEqual(len(self.stand_in.requests), 2)
+
+    def test_unsent_request_is_retried(self):
+        modification = self.get_client(url=get_unused_url()).submit(
+            capture(reference=None))
+
+        self.assertTrue(modification.error.startswith('Connection error'))
+        self.assertFalse(modification.uncertain)
+
+    def test_client_error_is_not_retried(self):
+        self.stand_in.responses = [(422, {'message': 'Invalid amount'})]
+        modification = self.get_client().submit(capture())
+
+        self.assertEqual(modification.error,
+                         'HTTP 422: {"message": "Invalid amount"}')
+        self.assertFalse(modification.uncertain)
+        self.assertEqual(len(self.stand_in.requests), 1)
+
+    def test_rate(self):
+        client = self.get_client(rate=20)
+        client.submit_all([capture('order-{}'.format(i)) for i in range(6)])
+
+        times = sorted(r['time'] for r in self.stand_in.requests)
+        self.assertGreaterEqual(times[-1] - times[0], 5 / 20.0 * 0.9)
+
+    def test_submit_all(self):
+        modifications = [capture('order-{}'.format(i)) for i in range(5)]
+        modifications.append(capture('order-5', idempotency_key='key'))
+        self.stand_in.responses = [(422, {})]
+
+        result = self.get_client().submit_all(modifications, concurrency=3)
+
+        self.assertEqual(result, modifications)
+        self.assertEqual(len([m for m in modifications if m.accepted]), 5)
+        self.assertEqual(len([m for m in modifications if m.error]), 1)
+        self.assertIn('key', [r['headers']['idempotency-key']
+                              for r in self.stand_in.requests])
+
+    def test_submit_all_records_unexpected_errors(self):
+        broken = capture('order-2')
+        broken.get_data = None
+        modifications = [capture('order-1'), broken, capture('order-3')]
+
+        self.get_client().submit_all(modifications, concurrency=1)
+
+        self.assertEqual([m.accepted for m in modifications],
+                         [True, False, True])
+        self.assertTrue(broken.error)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_wait(self):
+        limiter = RateLimiter(50)
+        times = []
+        for _ in range(5):
+            limiter.wait()
+            times.append(time.time())
+
+        # a late wakeup shortens the next interval, the rate holds overall
+        self.assertGreaterEqual(times[-1] - times[0], 4 * 0.02 * 0.9)
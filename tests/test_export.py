@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import csv
+from datetime import datetime
+from io import BytesIO
+import json
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+
+import pytz
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from django_adyen import export
+from django_adyen.models import Notification
+
+from .utils import create_notification
+
+CREATED = datetime(2015, 9, 1, 12, 0, 0, 123456, tzinfo=pytz.utc)
+
+
+def create(psp_reference, created_datetime=CREATED, **kwargs):
+    notification = create_notification(psp_reference=psp_reference, **kwargs)
+    Notification.objects.filter(pk=notification.pk).update(
+        created_datetime=created_datetime)
+    return notification
+
+
+def read_csv(content):
+    rows = list(csv.reader(BytesIO(content)))
+    return [dict(zip(rows[0], row)) for row in rows[1:]]
+
+
+def read_jsonl(content):
+    return [json.loads(line) for line in content.decode('utf-8').splitlines()]
+
+
+class ExportTest(TestCase):
+    def export(self, format=export.CSV, **kwargs):
+        fileobj = BytesIO()
+        count = export.export('notifications', fileobj, format=format,
+                              **kwargs)
+        return count, fileobj.getvalue()
+
+    def test_csv(self):
+        create('1', additional_params={'additionalData.foo': 'bär'})
+
+        count, content = self.export()
+
+        self.assertEqual(count, 1)
+        row, = read_csv(content)
+        self.assertEqual(row['psp_reference'], '1')
+        self.assertEqual(row['created_datetime'], CREATED.isoformat())
+        self.assertEqual(row['original_id'], '')
+        self.assertEqual(json.loads(row['additional_params'].decode('utf-8')),
+                         {'additionalData.foo': 'bär'})
+
+    def test_jsonl(self):
+        create('1', additional_params={'additionalData.foo': 'bär'})
+
+        count, content = self.export(export.JSONL)
+
+        self.assertEqual(count, 1)
+        record, = read_jsonl(content)
+        self.assertEqual(record['psp_reference'], '1')
+        self.assertEqual(record['created_datetime'], CREATED.isoformat())
+        self.assertEqual(record['event_date'], '2015-08-03T12:00:00+00:00')
+        self.assertIsNone(record['original_id'])
+        self.assertEqual(record['value'], 1000)
+        self.assertEqual(record['additional_params'],
+                         {'additionalData.foo': 'bär'})
+
+    def test_chunks(self):
+        for i in range(5):
+            create('{}'.format(i))
+
+        for chunk_size in [1, 2, 5, 6]:
+            count, content = self.export(export.JSONL, chunk_size=chunk_size)
+            self.assertEqual(count, 5)
+            self.assertEqual([r['psp_reference'] for r in read_jsonl(content)],
+                             ['0', '1', '2', '3', '4'])
+
+    def test_start_and_end(self):
+        for day in range(1, 5):
+            create('{}'.format(day),
+                   datetime(2015, 9, day, tzinfo=pytz.utc))
+
+        count, content = self.export(
+            export.JSONL, chunk_size=1,
+            start=datetime(2015, 9, 2, tzinfo=pytz.utc),
+            end=datetime(2015, 9, 4, tzinfo=pytz.utc))
+
+        self.assertEqual(count, 2)
+        self.assertEqual([r['psp_reference'] for r in read_jsonl(content)],
+                         ['2', '3'])
+
+    def test_event_codes(self):
+        create('1')
+        create('2', event_code=Notification.CHARGEBACK)
+        create('3', event_code=Notification.REPORT_AVAILABLE)
+
+        count, content = self.export(
+            event_codes=[Notification.CHARGEBACK,
+                         Notification.REPORT_AVAILABLE])
+
+        self.assertEqual(count, 2)
+        self.assertEqual([r['psp_reference'] for r in read_csv(content)],
+                         ['2', '3'])
+
+    def test_empty(self):
+        count, content = self.export()
+
+        self.assertEqual(count, 0)
+        self.assertEqual(read_csv(content), [])
+
+
+class ExportCommandTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_export(self):
+        create('1', datetime(2015, 9, 1, tzinfo=pytz.utc))
+        create('2', datetime(2015, 9, 2, tzinfo=pytz.utc),
+               event_code=Notification.CHARGEBACK)
+        path = os.path.join(self.directory, 'notifications.jsonl')
+        stderr = StringIO()
+
+        call_command('adyen_export', 'notifications', format=export.JSONL,
+                     output=path, event_codes=[Notification.CHARGEBACK],
+                     stderr=stderr)
+
+        with open(path, 'rb') as f:
+            records = read_jsonl(f.read())
+        self.assertEqual([r['psp_reference'] for r in records], ['2'])
+        self.assertIn("Exported 1 notifications.", stderr.getvalue())
+
+    def test_event_codes_of_other_kinds(self):
+        with self.assertRaises(CommandError):
+            call_command('adyen_export', 'payments',
+                         event_codes=[Notification.CHARGEBACK])
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from django_adyen.fields import RawJSON
+from django_adyen.models import Notification
+
+from .utils import create_notification
+
+
+class JSONFieldTest(TestCase):
+    def setUp(self):
+        create_notification(additional_params={'additionalData.foo': 'bar'})
+
+    def test_decoded_on_access(self):
+        notification = Notification.objects.get()
+
+        self.assertIsInstance(notification.__dict__['additional_params'],
+                              RawJSON)
+        self.assertEqual(notification.additional_params,
+                         {'additionalData.foo': 'bar'})
+
+    def test_values_list_returns_json_text(self):
+        value, = Notification.objects.values_list('additional_params',
+                                                  flat=True)
+
+        self.assertEqual(value, '{"additionalData.foo": "bar"}')
+
+    def test_deferred(self):
+        for notification in [
+                Notification.objects.defer('additional_params').get(),
+                Notification.objects.only('pk').get()]:
+            self.assertEqual(notification.additional_params,
+                             {'additionalData.foo': 'bar'})
+
+    def test_not_loaded(self):
+        notification = Notification.objects.get()
+        del notification.__dict__['additional_params']
+
+        self.assertEqual(notification.additional_params,
+                         {'additionalData.foo': 'bar'})
+
+    def test_none(self):
+        notification = create_notification(psp_reference='2')
+        notification.additional_params = None
+        notification.save()
+
+        self.assertIsNone(
+            Notification.objects.get(pk=notification.pk).additional_params)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.db import transaction
+from django.http import QueryDict
+from django.test import TransactionTestCase, override_settings
+
+from django_adyen import api
+from django_adyen.models import Notification, NotificationParam
+
+from .utils import create_notification, get_notification_params
+
+
+def get_params(**params):
+    query_dict = QueryDict('', mutable=True)
+    query_dict.update(get_notification_params(**params))
+    return query_dict
+
+
+class PersistNotificationTest(TransactionTestCase):
+    def setUp(self):
+        Notification.objects.recent_notifications.clear()
+        self.addCleanup(Notification.objects.recent_notifications.clear)
+
+    def test_duplicate(self):
+        original = api.get_payment_notification(get_params())
+        duplicate = api.get_payment_notification(get_params())
+
+        self.assertIsNone(original.original)
+        self.assertEqual(duplicate.original_id, original.pk)
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_recent_duplicate(self):
+        Notification.objects.recent_notifications.max_size = 10
+        self.addCleanup(setattr, Notification.objects.recent_notifications,
+                        'max_size', 0)
+
+        original = api.get_payment_notification(get_params())
+        duplicate = api.get_payment_notification(get_params(reason='x'))
+        repetition = api.get_payment_notification(get_params(reason='x'))
+
+        self.assertEqual(duplicate.original_id, original.pk)
+        self.assertEqual(repetition.original_id, original.pk)
+        self.assertIsNone(repetition.pk)
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_archived_original_isnt_used(self):
+        Notification.objects.recent_notifications.max_size = 10
+        self.addCleanup(setattr, Notification.objects.recent_notifications,
+                        'max_size', 0)
+
+        original = api.get_payment_notification(get_params())
+        # archived by another process, which can't clear this one's cache
+        Notification.objects.filter(pk=original.pk).delete()
+        repetition = api.get_payment_notification(get_params())
+
+        self.assertIsNotNone(repetition.pk)
+        self.assertIsNone(repetition.original)
+        self.assertEqual(Notification.objects.get(), repetition)
+
+    def test_rolled_back_notification_isnt_remembered(self):
+        Notification.objects.recent_notifications.max_size = 10
+        self.addCleanup(setattr, Notification.objects.recent_notifications,
+                        'max_size', 0)
+
+        try:
+            with transaction.atomic():
+                api.get_payment_notification(get_params())
+                raise ValueError()
+        except ValueError:
+            pass
+
+        notification = api.get_payment_notification(get_params())
+
+        self.assertIsNotNone(notification.pk)
+        self.assertIsNone(notification.original)
+
+    @override_settings(
+        ADYEN_INDEXED_ADDITIONAL_PARAMS=['additionalData.fraudScore'])
+    def test_indexed_additional_params(self):
+        notification = api.get_payment_notification(
+            get_params(**{'additionalData.fraudScore': '100'}))
+
+        self.assertEqual(
+            list(Notification.objects.with_additional_param(
+                'additionalData.fraudScore', '100')),
+            [notification])
+
+    @override_settings(
+        ADYEN_INDEXED_ADDITIONAL_PARAMS=['additionalData.fraudScore'])
+    def test_index_additional_params(self):
+        indexed = api.get_payment_notification(
+            get_params(**{'additionalData.fraudScore': '100'}))
+        existing = [
+            create_notification(
+                additional_params={'additionalData.fraudScore': '100'}),
+            create_notification(additional_params={'other': '100'}),
+            create_notification(
+                additional_params={'additionalData.fraudScore': 100}),
+            create_notification(),
+        ]
+
+        Notification.objects.index_additional_params(chunk_size=1)
+        Notification.objects.index_additional_params(existing)
+
+        self.assertEqual(NotificationParam.objects.count(), 2)
+        self.assertEqual(
+            list(Notification.objects.with_additional_param(
+                'additionalData.fraudScore', '100').order_by('pk')),
+            [indexed, existing[0]])
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from django_adyen import api
+from django_adyen.models import Payment
+
+
+def build_absolute_uri(path):
+    return 'https://shop.example.com' + path
+
+
+def pay(amount=1000, force_multi=False, **fields):
+    payment = api.create_payment('order', amount, 'EUR')
+    for name, value in fields.items():
+        setattr(payment, name, value)
+    url = api.pay(payment, build_absolute_uri, force_multi=force_multi)
+    return payment, url
+
+
+@override_settings(ADYEN_REDIRECT_CACHE='redirects')
+class RedirectCacheTest(TestCase):
+    def setUp(self):
+        caches['redirects'].clear()
+
+    def test_repetition(self):
+        payment, url = pay()
+        repeated_payment, repeated_url = pay()
+
+        self.assertEqual(repeated_url, url)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(repeated_payment.merchant_reference,
+                         payment.merchant_reference)
+        self.assertEqual(payment.merchant_reference,
+                         'order-{}'.format(Payment.objects.get().pk))
+
+    def test_changed_field(self):
+        _, url = pay()
+        _, other_url = pay(amount=2000)
+        _, email_url = pay(shopper_email='shopper@example.com')
+
+        self.assertEqual(len({url, other_url, email_url}), 3)
+        self.assertEqual(Payment.objects.count(), 3)
+
+    def test_force_multi(self):
+        _, url = pay()
+        _, multi_url = pay(force_multi=True)
+
+        self.assertNotEqual(multi_url, url)
+        self.assertEqual(Payment.objects.count(), 2)
+
+    def test_short_session_isnt_cached(self):
+        _, url = pay(session_validity=timedelta(minutes=30))
+        _, other_url = pay(session_validity=timedelta(minutes=30))
+
+        self.assertNotEqual(other_url, url)
+        self.assertEqual(Payment.objects.count(), 2)
+
+    @override_settings(ADYEN_REDIRECT_CACHE_MARGIN=60)
+    def test_margin(self):
+        _, url = pay(session_validity=timedelta(minutes=30))
+        _, other_url = pay(session_validity=timedelta(minutes=30))
+
+        self.assertEqual(other_url, url)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    @override_settings(ADYEN_REDIRECT_CACHE=None)
+    def test_disabled(self):
+        _, url = pay()
+        _, other_url = pay()
+
+        self.assertNotEqual(other_url, url)
+        self.assertEqual(Payment.objects.count(), 2)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.test import TestCase, override_settings
+
+from django_adyen.models import Notification
+from django_adyen.processing import HandlerRegistry, NotificationProcessor
+
+from .utils import create_notification
+
+
+class NotificationProcessorTest(TestCase):
+    def setUp(self):
+        self.registry = HandlerRegistry()
+        self.handled = []
+
+    def register(self, event_code, handler=None):
+        def handle(notification):
+            self.handled.append(notification.psp_reference)
+            if handler is not None:
+                handler(notification)
+        self.registry.register(event_code)(handle)
+
+    def get_processor(self, **kwargs):
+        kwargs.setdefault('max_workers', 1)
+        kwargs.setdefault('poll_interval', 0)
+        return NotificationProcessor(self.registry, **kwargs)
+
+    def test_process_unhandled(self):
+        self.register(Notification.AUTHORISATION)
+        create_notification(psp_reference='1')
+        create_notification(psp_reference='2')
+
+        self.assertEqual(self.get_processor().process_unhandled(), 2)
+
+        self.assertEqual(self.handled, ['1', '2'])
+        self.assertFalse(Notification.objects.filter(handled=False).exists())
+
+    def test_lanes_fetch_separately(self):
+        self.register(Notification.REPORT_AVAILABLE)
+        self.register(Notification.CHARGEBACK)
+        for i in range(5):
+            create_notification(Notification.REPORT_AVAILABLE,
+                                'report-{}'.format(i))
+        create_notification(Notification.CHARGEBACK, 'chargeback')
+
+        self.get_processor().process_unhandled(limit=2)
+
+        self.assertEqual(self.handled[0], 'chargeback')
+        self.assertEqual(len(self.handled), 2)
+
+    def test_notifications_without_handler_are_not_fetched(self):
+        self.register(Notification.CHARGEBACK)
+        create_notification(Notification.REPORT_AVAILABLE, 'report')
+
+        self.assertEqual(self.get_processor().process_unhandled(), 0)
+
+        notification = Notification.objects.get()
+        self.assertFalse(notification.handled)
+        self.assertIsNone(notification.claimed_by)
+
+    def test_notification_arriving_during_run_is_handled(self):
+        self.register(Notification.CHARGEBACK)
+        self.register(Notification.AUTHORISATION, lambda notification:
+                      create_notification(Notification.CHARGEBACK,
+                                          'chargeback'))
+        create_notification(psp_reference='1')
+
+        self.assertEqual(self.get_processor().process_unhandled(), 2)
+        self.assertEqual(self.handled, ['1', 'chargeback'])
+
+    def test_overlapping_runs_dont_handle_the_same_notification(self):
+        other_run_handled = []
+
+        def start_other_run(notification):
+            other_run_handled.append(
+                self.get_processor().process_unhandled())
+        self.register(Notification.AUTHORISATION, start_other_run)
+        self.register(Notification.CHARGEBACK)
+        create_notification(psp_reference='1')
+        create_notification(psp_reference='2')
+        create_notification(Notification.CHARGEBACK, 'chargeback')
+
+        self.assertEqual(self.get_processor().process_unhandled(), 3)
+
+        self.assertEqual(other_run_handled, [0, 0])
+        self.assertEqual(sorted(self.handled), ['1', '2', 'chargeback'])
+
+    def test_expired_claims_are_taken_over(self):
+        self.register(Notification.AUTHORISATION)
+        create_notification()
+        Notification.objects.claim(Notification.objects.all(), 'crashed')
+
+        with self.settings(ADYEN_NOTIFICATION_CLAIM_TIMEOUT=-1):
+            self.assertEqual(self.get_processor().process_unhandled(), 1)
+
+    def test_failed_notification_is_released_after_the_run(self):
+        def fail(notification):
+            raise ValueError()
+        self.register(Notification.AUTHORISATION, fail)
+        create_notification()
+
+        self.assertEqual(self.get_processor().process_unhandled(), 0)
+
+        self.assertEqual(len(self.handled), 1)
+        notification = Notification.objects.get()
+        self.assertFalse(notification.handled)
+        self.assertIsNone(notification.claimed_by)
+
+    def test_process_skips_claimed_notifications(self):
+        self.register(Notification.AUTHORISATION)
+        claimed = create_notification(psp_reference='1')
+        create_notification(psp_reference='2')
+        Notification.objects.claim([claimed], 'other')
+
+        processor = self.get_processor()
+        self.assertEqual(processor.process(Notification.objects.all()), 1)
+        self.assertEqual(self.handled, ['2'])
+
+    @override_settings(DATABASE_ROUTERS=['django_adyen.routers.AdyenRouter'],
+                       ADYEN_WRITE_DATABASE='default',
+                       ADYEN_READ_DATABASES=['replica'])
+    def test_process_with_lagging_replica(self):
+        self.register(Notification.AUTHORISATION)
+        notification = create_notification()
+
+        processor = self.get_processor()
+        self.assertEqual(processor.process([notification]), 1)
+        self.assertTrue(
+            Notification.objects.using('default').get().handled)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import base64
+
+from django.core.urlresolvers import reverse
+from django.http import QueryDict
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+
+from adyen.client import Modification, PaymentClient
+from django_adyen import api
+from django_adyen.instrumentation import (QUERY_BUDGETS, QueryBudgetExceeded,
+                                          QueryBudgetMixin, get_budget)
+from django_adyen import models
+from django_adyen.models import Notification, Result
+from django_adyen.processing import HandlerRegistry, NotificationProcessor
+
+from .stand_in import StandIn
+from .utils import create_notification, get_notification_params
+
+
+def build_absolute_uri(path):
+    return 'https://shop.example.com' + path
+
+
+def get_payment_result_params():
+    payment = api.create_payment('order', 1000, 'EUR')
+    url = api.pay(payment, build_absolute_uri)
+    return api.mock_payment_result_params(url)
+
+
+def get_notification_query_dict(**params):
+    query_dict = QueryDict('', mutable=True)
+    query_dict.update(get_notification_params(**params))
+    return query_dict
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        Result.objects.recent_results.clear()
+
+    def test_pay(self):
+        payment = api.create_payment('order', 1000, 'EUR')
+        with self.assertQueryBudget('pay'):
+            api.pay(payment, build_absolute_uri)
+
+    def test_get_payment_result(self):
+        params = get_payment_result_params()
+        with self.assertQueryBudget('get_payment_result'):
+            api.get_payment_result(params)
+        with self.assertQueryBudget('get_payment_result'):
+            api.get_payment_result(params)
+        self.assertEqual(Result.objects.count(), 1)
+
+    def test_get_payment_notification(self):
+        with self.assertQueryBudget('get_payment_notification'):
+            api.get_payment_notification(get_notification_query_dict())
+        with self.assertQueryBudget('get_payment_notification'):
+            api.get_payment_notification(get_notification_query_dict())
+
+    @override_settings(
+        ADYEN_INDEXED_ADDITIONAL_PARAMS=['additionalData.fraudScore'])
+    def test_get_payment_notification_with_indexed_params(self):
+        with self.assertQueryBudget('get_payment_notification'):
+            api.get_payment_notification(get_notification_query_dict(
+                **{'additionalData.fraudScore': '100'}))
+
+    def test_adyen_link(self):
+        create_notification(psp_reference='8514000000000001')
+        template = Template('{% load adyen_tags %}{% adyen_link psp %}')
+        with self.assertQueryBudget('adyen_link'):
+            link = template.render(Context({'psp': '8514000000000001'}))
+        self.assertIn('pspReference=8514000000000001', link)
+
+    def test_payment_result_view(self):
+        params = get_payment_result_params()
+        with self.assertQueryBudget('payment_result_view'):
+            response = self.client.get(
+                reverse('django-adyen:payment-result'), params)
+        self.assertEqual(response.status_code, 200)
+
+    def test_notification_view(self):
+        with self.assertQueryBudget('notification_view'):
+            response = self.client.post(
+                reverse('django-adyen:payment-notification'),
+                get_notification_params(),
+                HTTP_AUTHORIZATION='Basic {}'.format(
+                    base64.b64encode(b'user:password')))
+        self.assertEqual(response.content, b'[accepted]')
+
+    def test_process_unhandled_notifications(self):
+        registry = HandlerRegistry()
+        registry.register(Notification.AUTHORISATION)(lambda n: None)
+        for i in range(3):
+            create_notification(psp_reference='{}'.format(i))
+        processor = NotificationProcessor(registry, max_workers=1,
+                                          poll_interval=0)
+
+        with self.assertQueryBudget('process_unhandled_notifications'):
+            handled = api.process_unhandled_notifications(processor)
+        self.assertEqual(handled, 3)
+        self.assertFalse(
+            Notification.objects.filter(handled=False).exists())
+
+    def test_submit_modifications(self):
+        stand_in = StandIn().start()
+        self.addCleanup(stand_in.stop)
+        client = PaymentClient('MerchantAccount', 'ws', 'password',
+                               url=stand_in.url)
+        self.addCleanup(client.close)
+        previous_client, api._payment_client = api._payment_client, client
+        self.addCleanup(setattr, api, '_payment_client', previous_client)
+        payments = [api.create_payment('order', 1000, 'EUR')
+                    for _ in range(3)]
+        for payment in payments:
+            api.pay(payment, build_absolute_uri)
+
+        with self.assertQueryBudget('submit_modifications'):
+            modifications = api.submit_modifications([
+                Modification(Modification.CAPTURE, '8514000000000001', 1000,
+                             'EUR', payment.merchant_reference)
+                for payment in payments])
+        self.assertEqual([m.response for m in modifications],
+                         ['[capture-received]'] * 3)
+        self.assertEqual(models.Modification.objects.filter(
+            payment__isnull=False).count(), 3)
+
+    def test_exceeded(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with self.assertQueryBudget(0):
+                create_notification()
+
+
+class GetBudgetTest(TestCase):
+    @override_settings(ADYEN_QUERY_BUDGETS={'pay': 1})
+    def test_partial_setting(self):
+        self.assertEqual(get_budget('pay'), 1)
+        self.assertEqual(get_budget('adyen_link'),
+                         QUERY_BUDGETS['adyen_link'])
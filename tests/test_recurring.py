@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from datetime import date
+
+from django.test import TestCase, override_settings
+
+from adyen.client import PaymentClient, RecurringAuthorisation
+from django_adyen import api
+from django_adyen.models import Notification, RecurringCharge
+from django_adyen.recurring import correlate_notifications, run_billing
+
+from .stand_in import StandIn
+from .utils import create_notification
+
+DUE_DATE = date(2015, 9, 1)
+
+
+def schedule(merchant_reference, due_date=DUE_DATE, **kwargs):
+    return RecurringCharge.objects.schedule(
+        shopper_reference='shopper-1', amount=999, currency='EUR',
+        merchant_reference=merchant_reference, due_date=due_date, **kwargs)
+
+
+def submit(charge, psp_reference, status=RecurringCharge.SUBMITTED):
+    RecurringCharge.objects.filter(pk=charge.pk).update(
+        status=status, run='run', psp_reference=psp_reference)
+
+
+def get_authorisation(result_code=None, error=None, uncertain=False):
+    authorisation = RecurringAuthorisation('shopper-1', 999, 'EUR', 'ref')
+    authorisation.result_code = result_code
+    authorisation.error = error
+    authorisation.uncertain = uncertain
+    return authorisation
+
+
+class RecurringChargeManagerTest(TestCase):
+    def test_due(self):
+        due = schedule('due')
+        schedule('later', due_date=date(2015, 9, 2))
+        submit(schedule('submitted'), '1')
+
+        self.assertEqual(list(RecurringCharge.objects.due(DUE_DATE)), [due])
+
+    def test_claim(self):
+        charges = [schedule('charge-{}'.format(i)) for i in range(3)]
+
+        claimed = RecurringCharge.objects.claim(charges, 'run-1')
+
+        self.assertEqual(claimed, charges)
+        self.assertEqual(set(c.status for c in claimed),
+                         {RecurringCharge.SUBMITTED})
+        self.assertEqual(set(c.run for c in claimed), {'run-1'})
+
+    def test_claim_by_concurrent_runs(self):
+        charges = [schedule('charge-{}'.format(i)) for i in range(3)]
+        # both runs read the same chunk of due charges
+        stale_chunk = list(RecurringCharge.objects.due(DUE_DATE))
+
+        first = RecurringCharge.objects.claim(stale_chunk[:2], 'run-1')
+        second = RecurringCharge.objects.claim(stale_chunk, 'run-2')
+
+        self.assertEqual(first, charges[:2])
+        self.assertEqual(second, charges[2:])
+
+    @override_settings(DATABASE_ROUTERS=['django_adyen.routers.AdyenRouter'],
+                       ADYEN_WRITE_DATABASE='default',
+                       ADYEN_READ_DATABASES=['replica'])
+    def test_claim_with_lagging_replica(self):
+        charge = schedule('charge')
+
+        self.assertEqual(RecurringCharge.objects.claim([charge], 'run-1'),
+                         [charge])
+
+    def test_record_outcomes(self):
+        charges = [schedule('charge-{}'.format(i)) for i in range(5)]
+        authorisations = [
+            get_authorisation(RecurringAuthorisation.AUTHORISED),
+            get_authorisation(RecurringAuthorisation.REFUSED),
+            get_authorisation(RecurringAuthorisation.RECEIVED),
+            get_authorisation(error='HTTP 422: {}'),
+            get_authorisation(error='Connection error: timed out',
+                              uncertain=True),
+        ]
+        authorisations[1].refusal_reason = 'Not enough balance'
+        for i, authorisation in enumerate(authorisations):
+            authorisation.psp_reference = '{}'.format(i)
+
+        with self.assertNumQueries(1):
+            RecurringCharge.objects.record_outcomes(charges, authorisations)
+
+        self.assertEqual(
+            list(RecurringCharge.objects.order_by('pk').values_list(
+                'status', 'psp_reference', 'refusal_reason', 'error')),
+            [(RecurringCharge.AUTHORISED, '0', None, None),
+             (RecurringCharge.REFUSED, '1', 'Not enough balance', None),
+             (RecurringCharge.SUBMITTED, '2', None, None),
+             (RecurringCharge.ERROR, '3', None, 'HTTP 422: {}'),
+             (RecurringCharge.SUBMITTED, '4', None,
+              'Connection error: timed out')])
+
+    def test_update_each(self):
+        first, second = schedule('first'), schedule('second')
+        notification = create_notification()
+
+        RecurringCharge.objects.update_each({
+            first.pk: {'status': RecurringCharge.AUTHORISED,
+                       'notification': notification.pk},
+            second.pk: {'error': 'failed'},
+        })
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.status, RecurringCharge.AUTHORISED)
+        self.assertEqual(first.notification, notification)
+        self.assertIsNone(first.error)
+        self.assertEqual(second.status, RecurringCharge.PENDING)
+        self.assertIsNone(second.notification)
+        self.assertEqual(second.error, 'failed')
+
+    def test_update_each_without_values(self):
+        with self.assertNumQueries(0):
+            RecurringCharge.objects.update_each({})
+
+    def test_correlate_notifications(self):
+        authorised, refused, waiting, unsubmitted = [
+            schedule('charge-{}'.format(i)) for i in range(4)]
+        submit(authorised, 'psp-1')
+        submit(refused, 'psp-2', RecurringCharge.AUTHORISED)
+        submit(waiting, 'psp-3')
+        notification = create_notification(psp_reference='psp-1')
+        create_notification(psp_reference='psp-1', original=notification)
+        create_notification(psp_reference='psp-2', success=False)
+        create_notification(Notification.CAPTURE, 'psp-3')
+        # only submitted charges are matched on merchant_reference
+        create_notification(psp_reference='psp-4',
+                            merchant_reference='charge-3')
+
+        self.assertEqual(correlate_notifications(chunk_size=1), 2)
+
+        statuses = dict(RecurringCharge.objects.values_list(
+            'merchant_reference', 'status'))
+        self.assertEqual(statuses, {
+            'charge-0': RecurringCharge.AUTHORISED,
+            'charge-1': RecurringCharge.REFUSED,
+            'charge-2': RecurringCharge.SUBMITTED,
+            'charge-3': RecurringCharge.PENDING,
+        })
+        authorised.refresh_from_db()
+        self.assertEqual(authorised.notification, notification)
+        self.assertEqual(correlate_notifications(), 0)
+
+    def test_deleting_notification_keeps_charge(self):
+        charge = schedule('charge')
+        notification = create_notification()
+        RecurringCharge.objects.update_each(
+            {charge.pk: {'notification': notification.pk}})
+
+        notification.delete()
+
+        charge.refresh_from_db()
+        self.assertIsNone(charge.notification)
+
+
+class RunBillingTest(TestCase):
+    def setUp(self):
+        self.stand_in = StandIn().start()
+        self.addCleanup(self.stand_in.stop)
+        self.use_client(retry_delay=0)
+
+    def use_client(self, **kwargs):
+        client = PaymentClient('MerchantAccount', 'ws', 'password',
+                               url=self.stand_in.url, **kwargs)
+        self.addCleanup(client.close)
+        previous_client, api._payment_client = api._payment_client, client
+        self.addCleanup(setattr, api, '_payment_client', previous_client)
+
+    def test_run_billing(self):
+        charges = [schedule('charge-{}'.format(i)) for i in range(5)]
+        schedule('later', due_date=date(2015, 9, 2))
+
+        statuses = run_billing(DUE_DATE, chunk_size=2)
+
+        self.assertEqual(statuses, {RecurringCharge.AUTHORISED: 5})
+        self.assertEqual(
+            sorted(r['data']['reference'] for r in self.stand_in.requests),
+            ['charge-{}'.format(i) for i in range(5)])
+        self.assertEqual(
+            sorted(r['headers']['idempotency-key']
+                   for r in self.stand_in.requests),
+            sorted(charge.get_idempotency_key() for charge in charges))
+        self.assertEqual(run_billing(DUE_DATE), {})
+        self.assertEqual(len(self.stand_in.requests), 5)
+
+    def test_request(self):
+        schedule('charge', shopper_email='shopper@example.com')
+
+        run_billing(DUE_DATE)
+
+        request, = self.stand_in.requests
+        self.assertEqual(request['action'], 'authorise')
+        self.assertEqual(request['data'], {
+            'merchantAccount': 'MerchantAccount',
+            'amount': {'value': 999, 'currency': 'EUR'},
+            'reference': 'charge',
+            'shopperReference': 'shopper-1',
+            'selectedRecurringDetailReference': 'LATEST',
+            'recurring': {'contract': 'RECURRING'},
+            'shopperInteraction': 'ContAuth',
+            'shopperEmail': 'shopper@example.com',
+        })
+
+    def test_server_error_is_retried(self):
+        charge = schedule('charge')
+        self.stand_in.responses = [(500, {})]
+
+        self.assertEqual(run_billing(DUE_DATE),
+                         {RecurringCharge.AUTHORISED: 1})
+
+        self.assertEqual(
+            [r['headers']['idempotency-key'] for r in self.stand_in.requests],
+            [charge.get_idempotency_key()] * 2)
+
+    def test_uncertain_outcome_stays_submitted(self):
+        self.use_client(retries=0)
+        charge = schedule('charge')
+        self.stand_in.responses = [(500, {})]
+
+        self.assertEqual(run_billing(DUE_DATE),
+                         {RecurringCharge.SUBMITTED: 1})
+
+        charge.refresh_from_db()
+        self.assertEqual(charge.status, RecurringCharge.SUBMITTED)
+        self.assertEqual(charge.error, 'HTTP 500: {}')
+        self.assertIsNone(charge.psp_reference)
+
+        notification = create_notification(psp_reference='psp-1',
+                                           merchant_reference='charge')
+        self.assertEqual(correlate_notifications(), 1)
+
+        charge.refresh_from_db()
+        self.assertEqual(charge.status, RecurringCharge.AUTHORISED)
+        self.assertEqual(charge.psp_reference, 'psp-1')
+        self.assertEqual(charge.notification, notification)
+        self.assertEqual(correlate_notifications(), 0)
+
+    def test_refused(self):
+        schedule('charge')
+        self.stand_in.responses = [
+            (200, {'pspReference': '1', 'resultCode': 'Refused',
+                   'refusalReason': 'Expired Card'})]
+
+        self.assertEqual(run_billing(DUE_DATE), {RecurringCharge.REFUSED: 1})
+        self.assertEqual(RecurringCharge.objects.get().refusal_reason,
+                         'Expired Card')
+
+    def test_received_is_settled_by_notification(self):
+        schedule('charge')
+        self.stand_in.responses = [
+            (200, {'pspReference': 'psp-1', 'resultCode': 'Received'})]
+
+        self.assertEqual(run_billing(DUE_DATE),
+                         {RecurringCharge.SUBMITTED: 1})
+
+        create_notification(psp_reference='psp-1')
+        self.assertEqual(correlate_notifications(), 1)
+        self.assertEqual(RecurringCharge.objects.get().status,
+                         RecurringCharge.AUTHORISED)
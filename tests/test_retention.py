@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+import json
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+import zlib
+
+import pytz
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from django_adyen import retention
+from django_adyen.models import Notification, NotificationParam, Result
+
+from .utils import create_notification
+
+OLD = datetime(2015, 1, 1, tzinfo=pytz.utc)
+CUTOFF = datetime(2015, 6, 1, tzinfo=pytz.utc)
+NEW = datetime(2015, 9, 1, tzinfo=pytz.utc)
+
+
+def create(psp_reference, created_datetime=OLD, handled=True, **kwargs):
+    notification = create_notification(psp_reference=psp_reference,
+                                       handled=handled, **kwargs)
+    Notification.objects.filter(pk=notification.pk).update(
+        created_datetime=created_datetime)
+    return notification
+
+
+def create_result(psp_reference, created_datetime=OLD):
+    result = Result.objects.create(
+        auth_result='AUTHORISED', psp_reference=psp_reference,
+        merchant_reference='order-1', skin_code='aKhNrM6V',
+        shopper_locale='en_GB')
+    Result.objects.filter(pk=result.pk).update(
+        created_datetime=created_datetime)
+    return result
+
+
+def read_members(path):
+    """
+    Return the records of each gzip member of the archive file.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    members = []
+    while data:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        lines = decompressor.decompress(data).decode('utf-8').splitlines()
+        members.append([json.loads(line) for line in lines])
+        data = decompressor.unused_data
+    return members
+
+
+class ArchiveTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def get_archive_files(self):
+        return [os.path.join(self.directory, name)
+                for name in sorted(os.listdir(self.directory))]
+
+
+class ArchiveNotificationsTest(ArchiveTestCase):
+    def archive(self, **kwargs):
+        return retention.archive_notifications(CUTOFF, self.directory,
+                                               **kwargs)
+
+    def test_archive(self):
+        archived = create('old')
+        create('unhandled', handled=False)
+        create('new', NEW)
+
+        self.assertEqual(self.archive(), 1)
+
+        path, = self.get_archive_files()
+        self.assertTrue(os.path.basename(path).startswith('notification-'))
+        (record,), = read_members(path)
+        self.assertEqual(record['model'], 'django_adyen.notification')
+        self.assertEqual(record['pk'], archived.pk)
+        self.assertEqual(record['fields']['psp_reference'], 'old')
+        self.assertEqual(
+            sorted(Notification.objects.values_list('psp_reference',
+                                                    flat=True)),
+            ['new', 'unhandled'])
+
+    def test_duplicates_are_archived_with_their_original(self):
+        original = create('1', additional_params={'fraudScore': '100'})
+        create('1', NEW, original=original)
+        NotificationParam.objects.create(notification=original,
+                                         key='fraudScore', value='100')
+
+        self.assertEqual(self.archive(), 2)
+
+        members, = read_members(self.get_archive_files()[0])
+        self.assertEqual(len(members), 2)
+        self.assertFalse(Notification.objects.exists())
+        self.assertFalse(NotificationParam.objects.exists())
+
+    def test_batches(self):
+        for i in range(3):
+            original = create('{}'.format(i))
+            create('{}'.format(i), original=original)
+
+        self.assertEqual(self.archive(batch_size=1), 6)
+
+        path, = self.get_archive_files()
+        members = read_members(path)
+        self.assertEqual([len(member) for member in members], [2, 2, 2])
+        self.assertEqual(
+            [record['fields']['psp_reference']
+             for member in members for record in member],
+            ['0', '0', '1', '1', '2', '2'])
+        self.assertFalse(Notification.objects.exists())
+
+    def test_referenced_batch_is_kept(self):
+        original = create('1')
+        duplicate = create('1', original=original)
+        # refers to the duplicate rather than to the original
+        create('1', original=duplicate)
+
+        with self.assertRaises(retention.ArchiveError):
+            self.archive()
+
+        self.assertEqual(Notification.objects.count(), 3)
+        self.assertEqual(self.get_archive_files(), [])
+
+    def test_nothing_to_archive(self):
+        create('new', NEW)
+
+        self.assertEqual(self.archive(), 0)
+
+        self.assertEqual(self.get_archive_files(), [])
+
+
+class ArchiveResultsTest(ArchiveTestCase):
+    def test_archive(self):
+        for i in range(3):
+            create_result('old-{}'.format(i))
+        create_result('new', NEW)
+
+        self.assertEqual(
+            retention.archive_results(CUTOFF, self.directory, batch_size=2),
+            3)
+
+        path, = self.get_archive_files()
+        self.assertTrue(os.path.basename(path).startswith('result-'))
+        self.assertEqual(
+            [[record['fields']['psp_reference'] for record in member]
+             for member in read_members(path)],
+            [['old-0', 'old-1'], ['old-2']])
+        self.assertEqual(list(Result.objects.values_list('psp_reference',
+                                                         flat=True)),
+                         ['new'])
+
+
+class ArchiveCommandTest(ArchiveTestCase):
+    def test_archive(self):
+        now = timezone.now()
+        create('old', now - timedelta(days=91))
+        create('new', now - timedelta(days=89))
+        create_result('old', now - timedelta(days=31))
+        stdout = StringIO()
+
+        with override_settings(ADYEN_ARCHIVE_DIR=self.directory):
+            call_command('adyen_archive', days=30, stdout=stdout)
+
+        self.assertIn("Archived 2 notifications and 1 results.",
+                      stdout.getvalue())
+        self.assertEqual(len(self.get_archive_files()), 2)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_default_retention(self):
+        now = timezone.now()
+        create('old', now - timedelta(days=91))
+        create('new', now - timedelta(days=89))
+
+        with override_settings(ADYEN_ARCHIVE_DIR=self.directory):
+            self.assertEqual(retention.archive(), (1, 0))
+
+        self.assertEqual(Notification.objects.get().psp_reference, 'new')
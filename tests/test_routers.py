@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import threading
+
+from django.db import router
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from django_adyen import api
+from django_adyen.models import Notification, Result
+from django_adyen.routers import AdyenRouter, use_write_database
+from django_adyen.views import PaymentResultView
+
+from .utils import create_notification
+
+
+class OtherModel(object):
+    class _meta(object):
+        app_label = 'other'
+
+
+def build_absolute_uri(path):
+    return 'https://shop.example.com' + path
+
+
+@override_settings(DATABASE_ROUTERS=['django_adyen.routers.AdyenRouter'],
+                   ADYEN_WRITE_DATABASE='default',
+                   ADYEN_READ_DATABASES=['replica'])
+class AdyenRouterTest(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        Result.objects.recent_results.clear()
+
+    def test_write_and_read(self):
+        create_notification()
+
+        self.assertEqual(router.db_for_write(Notification), 'default')
+        self.assertEqual(router.db_for_read(Notification), 'replica')
+        self.assertEqual(Notification.objects.using('default').count(), 1)
+        self.assertEqual(Notification.objects.count(), 0)
+
+    def test_use_write_database(self):
+        create_notification()
+
+        with use_write_database():
+            self.assertEqual(Notification.objects.count(), 1)
+            with use_write_database():
+                pass
+            self.assertEqual(router.db_for_read(Notification), 'default')
+        self.assertEqual(Notification.objects.count(), 0)
+
+    def test_use_write_database_per_thread(self):
+        databases = []
+        thread = threading.Thread(target=lambda: databases.append(
+            router.db_for_read(Notification)))
+
+        with use_write_database():
+            thread.start()
+            thread.join()
+
+        self.assertEqual(databases, ['replica'])
+
+    def test_related_reads_stay_on_the_instance_database(self):
+        original = create_notification()
+        create_notification(original=original)
+
+        with use_write_database():
+            duplicate = Notification.objects.get(original__isnull=False)
+
+        self.assertEqual(duplicate.original, original)
+
+    def test_other_apps(self):
+        adyen_router = AdyenRouter()
+
+        self.assertIsNone(adyen_router.db_for_read(OtherModel))
+        self.assertIsNone(adyen_router.db_for_write(OtherModel))
+        self.assertIsNone(adyen_router.allow_migrate('replica', 'other'))
+
+    def test_allow_migrate(self):
+        adyen_router = AdyenRouter()
+
+        self.assertTrue(adyen_router.allow_migrate('default', 'django_adyen'))
+        self.assertFalse(adyen_router.allow_migrate('replica', 'django_adyen'))
+        with self.settings(ADYEN_WRITE_DATABASE=None):
+            self.assertIsNone(
+                adyen_router.allow_migrate('replica', 'django_adyen'))
+
+    def test_payment_result_view_reads_its_writes(self):
+        payment = api.create_payment('order', 1000, 'EUR')
+        params = api.mock_payment_result_params(
+            api.pay(payment, build_absolute_uri))
+
+        class ResultView(PaymentResultView):
+            def handle_payment_result(self, payment_result):
+                result = Result.objects.get(
+                    merchant_reference=payment_result.merchant_reference)
+                return HttpResponse('live={}'.format(result.live))
+
+        request = RequestFactory().get('/', params)
+        response = ResultView.as_view()(request)
+
+        # the result was stored for the payment, which is only on the
+        # write database
+        self.assertEqual(response.content, b'live=False')
+        self.assertEqual(Result.objects.count(), 0)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import base64
+from io import BytesIO
+import json
+import os
+import shutil
+import tempfile
+from urllib import urlencode
+
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError, OperationalError
+from django.test import TestCase
+
+from django_adyen import api as django_adyen_api
+from django_adyen import spool
+from django_adyen.models import Notification
+
+from .utils import get_notification_params
+
+CREDENTIALS = ('user', 'password')
+AUTHORIZATION = 'Basic {}'.format(base64.b64encode(b'user:password'))
+
+
+def get_body(**params):
+    return urlencode(get_notification_params(**params)).encode('utf-8')
+
+
+class SpoolTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = self.settings(ADYEN_SPOOL_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def read_dead_letters(self):
+        path = os.path.join(self.directory, spool.DEAD_LETTER_FILE)
+        with open(path) as f:
+            return [json.loads(line) for line in f]
+
+
+class DrainTest(SpoolTestCase):
+    def test_drain(self):
+        for i in range(3):
+            spool.get_spool().append(get_body(pspReference='{}'.format(i)))
+
+        self.assertEqual(spool.drain(batch_size=2), 3)
+
+        self.assertEqual(
+            sorted(Notification.objects.values_list('psp_reference',
+                                                    flat=True)),
+            ['0', '1', '2'])
+        self.assertEqual(spool.drain(), 0)
+
+    def test_processed_segments_are_deleted(self):
+        the_spool = spool.Spool(self.directory, segment_size=1)
+        for i in range(3):
+            the_spool.append(get_body(pspReference='{}'.format(i)))
+        self.assertEqual(len(the_spool.segments()), 3)
+
+        self.assertEqual(
+            the_spool.drain(spool.store_notifications), 3)
+
+        self.assertEqual(len(the_spool.segments()), 1)
+        self.assertEqual(Notification.objects.count(), 3)
+
+    def test_invalid_notification_is_dead_lettered(self):
+        the_spool = spool.get_spool()
+        the_spool.append(get_body(pspReference='1'))
+        the_spool.append(get_body(pspReference='2', value='invalid'))
+        the_spool.append(get_body(pspReference='3'))
+
+        self.assertEqual(spool.drain(), 3)
+
+        self.assertEqual(
+            sorted(Notification.objects.values_list('psp_reference',
+                                                    flat=True)),
+            ['1', '3'])
+        dead_letter, = self.read_dead_letters()
+        self.assertTrue(dead_letter['error'].startswith('ValueError'))
+        self.assertEqual(base64.b64decode(dead_letter['body']),
+                         get_body(pspReference='2', value='invalid'))
+        self.assertEqual(spool.drain(), 0)
+
+    def test_rejected_notification_is_dead_lettered(self):
+        get_payment_notification = django_adyen_api.get_payment_notification
+
+        def reject_second(params):
+            notification = get_payment_notification(params)
+            if params['pspReference'] == '2':
+                raise IntegrityError("rejected")
+            return notification
+        django_adyen_api.get_payment_notification = reject_second
+        self.addCleanup(setattr, django_adyen_api,
+                        'get_payment_notification', get_payment_notification)
+
+        for i in range(1, 4):
+            spool.get_spool().append(get_body(pspReference='{}'.format(i)))
+
+        self.assertEqual(spool.drain(), 3)
+
+        self.assertEqual(
+            sorted(Notification.objects.values_list('psp_reference',
+                                                    flat=True)),
+            ['1', '3'])
+        dead_letter, = self.read_dead_letters()
+        self.assertEqual(dead_letter['error'], 'IntegrityError: rejected')
+
+    def test_database_errors_fail_the_batch(self):
+        def fail(params):
+            raise OperationalError("database is down")
+        get_payment_notification = django_adyen_api.get_payment_notification
+        django_adyen_api.get_payment_notification = fail
+        try:
+            spool.get_spool().append(get_body())
+            with self.assertRaises(OperationalError):
+                spool.drain()
+        finally:
+            django_adyen_api.get_payment_notification = (
+                get_payment_notification)
+
+        self.assertEqual(spool.drain(), 1)
+        self.assertEqual(Notification.objects.count(), 1)
+
+
+class SpoolIntakeApplicationTest(SpoolTestCase):
+    def setUp(self):
+        super(SpoolIntakeApplicationTest, self).setUp()
+        self.application = spool.SpoolIntakeApplication(
+            credentials=CREDENTIALS)
+
+    def call(self, body, method='POST', authorization=AUTHORIZATION,
+             **environ):
+        environ.setdefault('CONTENT_LENGTH', '{}'.format(len(body)))
+        environ.update({
+            'REQUEST_METHOD': method,
+            'HTTP_AUTHORIZATION': authorization,
+            'wsgi.input': BytesIO(body),
+        })
+        statuses = []
+        content = self.application(
+            environ, lambda status, headers: statuses.append(status))
+        return statuses[0], b''.join(content)
+
+    def test_accept(self):
+        self.assertEqual(self.call(get_body()), (b'200 OK', b'[accepted]'))
+        self.assertEqual(spool.drain(), 1)
+
+    def test_chunked(self):
+        self.assertEqual(
+            self.call(get_body(), CONTENT_LENGTH='',
+                      **{'wsgi.input_terminated': True}),
+            (b'200 OK', b'[accepted]'))
+        self.assertEqual(spool.drain(), 1)
+
+    def test_reject_empty_body(self):
+        status, _ = self.call(get_body(), CONTENT_LENGTH='')
+        self.assertEqual(status, b'400 Bad Request')
+        status, _ = self.call(b'')
+        self.assertEqual(status, b'400 Bad Request')
+        self.assertEqual(spool.get_spool().segments(), [])
+
+    def test_reject_body_without_event_code(self):
+        status, _ = self.call(b'foo=bar')
+        self.assertEqual(status, b'400 Bad Request')
+
+    def test_unauthorized(self):
+        status, _ = self.call(get_body(), authorization='Basic invalid')
+        self.assertEqual(status, b'401 Unauthorized')
+
+    def test_method_not_allowed(self):
+        status, _ = self.call(b'', method='GET')
+        self.assertEqual(status, b'405 Method Not Allowed')
+
+
+class SpoolNotificationViewTest(SpoolTestCase):
+    def post(self, body):
+        return self.client.post(
+            reverse('django-adyen:payment-notification-spool'), body,
+            content_type='application/x-www-form-urlencoded',
+            HTTP_AUTHORIZATION=AUTHORIZATION)
+
+    def test_accept(self):
+        self.assertEqual(self.post(get_body()).content, b'[accepted]')
+        self.assertEqual(spool.drain(), 1)
+
+    def test_reject_empty_body(self):
+        self.assertEqual(self.post(b'').status_code, 400)
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.conf.urls import include, url
+
+from django_adyen import app
+
+urlpatterns = [
+    url(r'^adyen/', include(app.urls)),
+]
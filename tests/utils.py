@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from datetime import datetime
+
+import pytz
+
+from django_adyen.models import Notification
+
+
+def get_notification_params(**params):
+    """
+    Return the POST parameters of a notification as sent by Adyen.
+    """
+    defaults = {
+        'live': 'false',
+        'eventCode': 'AUTHORISATION',
+        'pspReference': '8514000000000001',
+        'originalReference': '',
+        'merchantReference': 'order-1',
+        'merchantAccountCode': 'MerchantAccount',
+        'eventDate': '2015-08-03T12:00:00.00Z',
+        'success': 'true',
+        'paymentMethod': 'visa',
+        'operations': 'CANCEL,CAPTURE,REFUND',
+        'reason': '',
+        'value': '1000',
+        'currency': 'EUR',
+    }
+    defaults.update(params)
+    return defaults
+
+
+def create_notification(event_code=Notification.AUTHORISATION,
+                        psp_reference='8514000000000001', **kwargs):
+    defaults = {
+        'live': False,
+        'merchant_reference': 'order-1',
+        'merchant_account_code': 'MerchantAccount',
+        'event_date': datetime(2015, 8, 3, 12, tzinfo=pytz.utc),
+        'success': True,
+        'value': 1000,
+        'currency': 'EUR',
+    }
+    defaults.update(kwargs)
+    return Notification.objects.create(event_code=event_code,
+                                       psp_reference=psp_reference, **defaults)